@@ -0,0 +1,84 @@
+"""
+Nightly analytics at scale.
+
+    python benchmarks/analytics.py [--rows 2000000] [--users 50000]
+
+Fills a throwaway database with synthetic user_questions rows spread over the last
+year and times AnalyticsService.run_nightly (load, vectorized compute, summary writes).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def populate(db_path, rows, users, questions=500, seed=7):
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE user_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, question_id INTEGER,
+            answered_correctly BOOLEAN, llm_confidence REAL, user_answer TEXT,
+            answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    today = int(time.time() // 86400)
+    # Distinct (user, question) pairs, as enforced by the unique index on user_questions
+    pairs = np.unique(rng.integers(0, users * questions, rows))
+    rng.shuffle(pairs)
+    rows = len(pairs)
+    user_ids = pairs // questions + 1
+    question_ids = pairs % questions + 1
+    correct = rng.random(rows) < 0.7
+    confidence = rng.random(rows)
+    days = today - rng.integers(0, 365, rows)
+    stamps = np.datetime_as_string(days.astype("datetime64[D]")).astype(object) + " 12:00:00"
+    conn.executemany(
+        "INSERT INTO user_questions (user_id, question_id, answered_correctly, llm_confidence, user_answer, answered_at) "
+        "VALUES (?, ?, ?, ?, '', ?)",
+        zip(user_ids.tolist(), question_ids.tolist(), correct.tolist(), confidence.tolist(), stamps.tolist())
+    )
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "analytics.db")
+        os.environ["DB_PATH"] = db_path
+        sys.path.insert(0, ROOT)
+
+        started = time.perf_counter()
+        rows = populate(db_path, args.rows, args.users)
+        print(f"Populated {rows:,} answers for {args.users:,} users in {time.perf_counter() - started:.1f} s")
+
+        import db
+        from services.analytics_service import AnalyticsService
+
+        # init_db expects the base questions table; it then seeds it and adds the analytics tables
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE questions (id INTEGER PRIMARY KEY AUTOINCREMENT, track TEXT, difficulty TEXT, "
+                     "question_text TEXT, canonical_answer TEXT, explanation TEXT)")
+        conn.close()
+        db.init_db()
+
+        started = time.perf_counter()
+        result = AnalyticsService().run_nightly()
+        print(f"run_nightly total: {time.perf_counter() - started:.2f} s "
+              f"(load {result['load_s']} s, compute {result['compute_s']} s, save {result['save_s']} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Import/export throughput and peak memory on a synthetic question bank.
+
+    python benchmarks/import_export.py [--questions 100000]
+
+Compares the previous approach (json.load + one execute per row, fetchall + json.dump)
+with the streaming pipeline in question_bank.py. Peak memory is measured with tracemalloc.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_bank import import_questions, export_questions
+
+SCHEMA = """
+CREATE TABLE questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    track TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    question_text TEXT NOT NULL,
+    canonical_answer TEXT NOT NULL,
+    explanation TEXT NOT NULL
+)
+"""
+
+
+def synthetic_question(i):
+    track = "sql" if i % 2 else "python"
+    return {
+        "track": track,
+        "difficulty": ("easy", "medium", "hard")[i % 3],
+        "question_text": f"Question {i}: given table `events_{i % 97}` with columns (id, user_id, ts), "
+                         f"how would you find the {i % 10 + 1}th most recent event per user?",
+        "canonical_answer": f"Use `ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY ts DESC)` and filter rn = {i % 10 + 1}.",
+        "explanation": "Window functions rank rows within each partition without collapsing them. " * 2,
+    }
+
+
+def write_bank(path, count):
+    with open(path, "w") as f:
+        if path.endswith(".jsonl"):
+            for i in range(count):
+                f.write(json.dumps(synthetic_question(i)) + "\n")
+        else:
+            f.write("[")
+            for i in range(count):
+                f.write(("," if i else "") + "\n  " + json.dumps(synthetic_question(i)))
+            f.write("\n]")
+
+
+def fresh_db(path):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.commit()
+    return conn
+
+
+def legacy_import(conn, path):
+    with open(path) as f:
+        questions = json.load(f)
+    cursor = conn.cursor()
+    for q in questions:
+        cursor.execute("""
+            INSERT INTO questions (track, difficulty, question_text, canonical_answer, explanation)
+            VALUES (?, ?, ?, ?, ?)
+        """, (q['track'], q['difficulty'], q['question_text'], q['canonical_answer'], q['explanation']))
+    conn.commit()
+
+
+def legacy_export(conn, path):
+    cursor = conn.cursor()
+    cursor.execute("SELECT track, difficulty, question_text, canonical_answer, explanation FROM questions")
+    questions = [
+        {"track": r[0], "difficulty": r[1], "question_text": r[2], "canonical_answer": r[3], "explanation": r[4]}
+        for r in cursor.fetchall()
+    ]
+    with open(path, "w") as f:
+        json.dump(questions, f, indent=2)
+
+
+def measure(label, fn, count, reset=None):
+    """Times fn without tracing, then re-runs it under tracemalloc for peak memory."""
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    if reset:
+        reset()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {elapsed:7.2f} s  {count / elapsed:10,.0f} q/s  peak {peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.questions
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "bank.json")
+        jsonl_path = os.path.join(tmp, "bank.jsonl")
+        db_path = os.path.join(tmp, "bench.db")
+        write_bank(json_path, n)
+        write_bank(jsonl_path, n)
+        print(f"Synthetic bank: {n:,} questions, {os.path.getsize(json_path) / 2**20:.1f} MiB JSON")
+
+        def reset():
+            conn.execute("DELETE FROM questions")
+            conn.commit()
+
+        conn = fresh_db(db_path)
+        measure("legacy import (json.load)", lambda: legacy_import(conn, json_path), n, reset)
+        measure("legacy export (json.dump)", lambda: legacy_export(conn, os.path.join(tmp, "out_legacy.json")), n)
+        conn.close()
+
+        conn = fresh_db(db_path)
+        measure("streaming import (JSON)", lambda: import_questions(conn, json_path), n, reset)
+        measure("streaming re-import (upsert)", lambda: import_questions(conn, json_path), n)
+        measure("streaming export (JSON)", lambda: export_questions(conn, os.path.join(tmp, "out.json")), n)
+        conn.close()
+
+        conn = fresh_db(db_path)
+        measure("streaming import (JSONL)", lambda: import_questions(conn, jsonl_path), n, reset)
+        measure("streaming export (JSONL)", lambda: export_questions(conn, os.path.join(tmp, "out.jsonl")), n)
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Leaderboard at scale.
+
+    python benchmarks/leaderboard.py [--users 1000000]
+
+Loads a synthetic board, then times incremental score updates, rank lookups and top-K
+reads, and compares a rank lookup with the ORDER BY/COUNT query it replaces.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.leaderboard import Leaderboard
+
+
+def timed(label, fn, ops):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {elapsed * 1e6 / ops:9.2f} µs/op  ({ops:,} ops, {elapsed:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    scores = [(user_id, min(int(rng.expovariate(1 / 40)) + 1, 2000)) for user_id in range(1, args.users + 1)]
+
+    board = Leaderboard()
+    started = time.perf_counter()
+    board.load(scores)
+    print(f"load {args.users:,} users: {time.perf_counter() - started:.2f} s")
+
+    users = [rng.randint(1, args.users) for _ in range(args.ops)]
+    timed("increment (correct answer)", lambda: [board.add(u) for u in users], args.ops)
+    timed("rank lookup", lambda: [board.rank(u) for u in users], args.ops)
+    timed("top-10", lambda: [board.top(10) for _ in range(10_000)], 10_000)
+
+    # Baseline: the per-request SQL it replaces
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "lb.db"))
+        conn.execute("CREATE TABLE scores (user_id INTEGER PRIMARY KEY, score INTEGER)")
+        conn.executemany("INSERT INTO scores VALUES (?, ?)", scores)
+        conn.commit()
+        sample = users[:50]
+        timed("SQL rank (COUNT score > mine)", lambda: [
+            conn.execute("SELECT 1 + COUNT(*) FROM scores WHERE score > (SELECT score FROM scores WHERE user_id = ?)",
+                         (u,)).fetchone() for u in sample
+        ], len(sample))
+        timed("SQL top-10 (ORDER BY)", lambda: [
+            conn.execute("SELECT user_id, score FROM scores ORDER BY score DESC LIMIT 10").fetchall()
+            for _ in range(10)
+        ], 10)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
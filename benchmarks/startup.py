@@ -0,0 +1,93 @@
+"""
+Startup benchmark: where does cold start go before the first poll?
+
+    python benchmarks/startup.py [--runs 5]
+
+1. `python -X importtime -c "import telegram_bot"`: total import time and the
+   heaviest modules by cumulative time.
+2. Cold boot to "ready to poll" (import main + init_db + create_app) in a fresh
+   interpreter, against a throwaway copy of the database and dummy credentials.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+from db import init_db
+init_db()
+main.quiz_service.warm_catalog()
+app = main.create_app()
+print(f"BOOT_MS {(time.perf_counter() - t0) * 1000:.1f}")
+"""
+
+
+def _env(db_path):
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:dummy-token-for-benchmark")
+    env.setdefault("OPENAI_API_KEY", "sk-dummy-for-benchmark")
+    env["DB_PATH"] = db_path
+    env["PYTHONPATH"] = ROOT
+    return env
+
+
+def import_profile(env, top=12):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import telegram_bot"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = [p.strip() for p in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    total_us = sum(self_us for _, self_us, _ in rows)
+    print(f"import telegram_bot: {total_us / 1000:.1f} ms total self time")
+    # Top-level entries only (no leading indentation) give per-package cost
+    top_level = sorted((r for r in rows if not r[2].startswith(" ")), reverse=True)[:top]
+    for cumulative_us, _, name in top_level:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+def boot_times(env, runs):
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", BOOT_SNIPPET], cwd=ROOT, env=env,
+                                capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            if line.startswith("BOOT_MS"):
+                times.append(float(line.split()[1]))
+        if result.returncode != 0:
+            print(result.stderr)
+            break
+    if times:
+        print(f"cold boot to ready-to-poll over {len(times)} runs: "
+              f"median {statistics.median(times):.1f} ms, min {min(times):.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "questions.db")
+        source_db = os.getenv("DB_PATH", os.path.join(ROOT, "data", "questions.db"))
+        if os.path.exists(source_db):
+            shutil.copy(source_db, db_path)
+        env = _env(db_path)
+        import_profile(env)
+        boot_times(env, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+HTTP transport under a send burst, against local stub servers.
+
+    python benchmarks/transport.py [--requests 500] [--latency-ms 30]
+
+Starts a keep-alive HTTP/1.1 stub that answers Bot API and chat-completions calls after a fixed
+latency and counts the TCP connections it accepts. Then fires a burst of concurrent
+send_message / chat.completions.create calls through:
+
+- the library defaults (the bot ApplicationBuilder builds, openai.AsyncClient()),
+- a fresh client per request (no connection reuse),
+- the pools from transport.py.
+
+The stub speaks plain HTTP/1.1, so HTTP/2 is off for the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["HTTP2"] = "0"
+
+import openai
+from telegram import Bot
+from telegram.ext import ApplicationBuilder
+
+import transport
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+MESSAGE = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "ok"}
+COMPLETION = {
+    "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "{\"is_correct\": true}"}}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+
+
+class StubServer:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *headers = head.decode("latin-1").split("\r\n")
+                length = 0
+                for header in headers:
+                    name, _, value = header.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+
+                path = request_line.split(" ")[1]
+                if path.endswith("/getMe"):
+                    payload = {"ok": True, "result": BOT_USER}
+                elif "/chat/completions" in path:
+                    payload = COMPLETION
+                else:
+                    payload = {"ok": True, "result": MESSAGE}
+                body = json.dumps(payload).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Connection: keep-alive\r\nContent-Length: " + str(len(body)).encode() +
+                             b"\r\n\r\n" + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def reset(self):
+        self.connections = self.requests = 0
+
+
+async def burst(label, server, n, call):
+    server.reset()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call(i) for i in range(n)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(isinstance(r, Exception) for r in results)
+    print(f"{label:<40} {elapsed:7.2f} s  {n / elapsed:8.0f} req/s  "
+          f"{server.connections:5} connections  {failed:4} failed")
+
+
+async def telegram_burst(server, n, label, make_bot):
+    base_url = f"http://127.0.0.1:{server.port}/bot"
+    if make_bot is None:
+        async def call(i):
+            async with Bot("1:stub", base_url=base_url) as bot:
+                await bot.send_message(chat_id=1, text=f"question {i}")
+        await burst(label, server, n, call)
+        return
+    async with make_bot(base_url) as bot:
+        await burst(label, server, n, lambda i: bot.send_message(chat_id=1, text=f"question {i}"))
+
+
+async def llm_burst(server, n, label, make_client):
+    base_url = f"http://127.0.0.1:{server.port}/v1"
+    messages = [{"role": "user", "content": "Is this answer correct?"}]
+    if make_client is None:
+        async def call(i):
+            async with openai.AsyncClient(api_key="stub", base_url=base_url) as client:
+                await client.chat.completions.create(model="stub", messages=messages)
+        await burst(label, server, n, call)
+        return
+    client = make_client(base_url)
+    try:
+        await burst(label, server, n,
+                    lambda i: client.chat.completions.create(model="stub", messages=messages))
+    finally:
+        await client.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    server = StubServer(args.latency_ms / 1000)
+    await server.start()
+    n = args.requests
+    print(f"{n} concurrent requests, {args.latency_ms:.0f} ms server latency\n")
+
+    print("Telegram send_message")
+    await telegram_burst(server, n, "ApplicationBuilder default", lambda url: ApplicationBuilder().token(
+        "1:stub").base_url(url).build().bot)
+    await telegram_burst(server, n, "new Bot per send", None)
+    await telegram_burst(server, n, f"transport.py ({transport.TELEGRAM_POOL_SIZE} connections)",
+                         lambda url: Bot("1:stub", base_url=url, request=transport.telegram_requests()[0]))
+
+    print("\nOpenAI chat.completions.create")
+    await llm_burst(server, n, "openai.AsyncClient() default", lambda url: openai.AsyncClient(
+        api_key="stub", base_url=url))
+    await llm_burst(server, n, "new client per call", None)
+    await llm_burst(server, n, f"transport.py ({transport.LLM_POOL_SIZE} connections)",
+                    lambda url: openai.AsyncClient(api_key="stub", base_url=url,
+                                                   http_client=transport.llm_http_client()))
+
+    server.server.close()
+    await server.server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
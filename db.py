@@ -1,15 +1,38 @@
 import sqlite3
 import os
 import json
+import hashlib
+from question_bank import import_questions, export_questions
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from typing import List, Optional
 
 DB_PATH = os.getenv('DB_PATH', os.path.join(os.path.dirname(__file__), 'data', 'questions.db'))
+# Per-task override of DB_PATH; set by use_database() (one database per tenant, see tenancy.py)
+_db_path: ContextVar[Optional[str]] = ContextVar("db_path", default=None)
+
+def current_db_path() -> str:
+    return _db_path.get() or DB_PATH
+
+@contextmanager
+def use_database(path: str):
+    """Routes get_connection() to path for this context and the tasks/threads it starts."""
+    token = _db_path.set(path)
+    try:
+        yield
+    finally:
+        _db_path.reset(token)
 
 def get_connection():
+    path = current_db_path()
     # Ensure the directory exists (crucial for cloud volumes)
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return sqlite3.connect(path)
+
+QUESTIONS_JSON_PATH = os.path.join(os.path.dirname(__file__), 'data', 'questions.json')
+# Near-duplicate check when loading questions.json: "warn" (default), "skip", or "off"
+QUESTION_DEDUP = {"warn": "warn", "skip": "skip"}.get(os.getenv("QUESTION_DEDUP", "warn").lower())
 
 def seed_questions():
     """Seeds the database from data/questions.json if the questions table is empty."""
@@ -22,88 +45,189 @@ def seed_questions():
         conn.close()
         return
 
-    json_path = os.path.join(os.path.dirname(__file__), 'data', 'questions.json')
-    if not os.path.exists(json_path):
-        print(f"Warning: {json_path} not found. No questions seeded.")
+    if not os.path.exists(QUESTIONS_JSON_PATH):
+        print(f"Warning: {QUESTIONS_JSON_PATH} not found. No questions seeded.")
         conn.close()
         return
 
-    with open(json_path, 'r') as f:
-        questions = json.load(f)
-
-    for q in questions:
-        cursor.execute("""
-            INSERT INTO questions (track, difficulty, question_text, canonical_answer, explanation)
-            VALUES (?, ?, ?, ?, ?)
-        """, (q['track'], q['difficulty'], q['question_text'], q['canonical_answer'], q['explanation']))
-    
-    conn.commit()
-    conn.close()
-    print(f"Seeded {len(questions)} questions from JSON.")
+    try:
+        result = import_questions(conn, QUESTIONS_JSON_PATH, dedup=QUESTION_DEDUP)
+    finally:
+        conn.close()
+    print(f"Seeded {result['inserted']} questions from JSON.")
 
 def update_existing_questions():
-    """Updates existing questions in the DB with the content from questions.json (to apply formatting fixes)."""
+    """
+    Upserts questions.json into the DB (to apply formatting fixes and add new questions).
+    Rows are matched by stable question key, not by their position in the file.
+    """
+    if not os.path.exists(QUESTIONS_JSON_PATH):
+        return
+
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    json_path = os.path.join(os.path.dirname(__file__), 'data', 'questions.json')
-    if not os.path.exists(json_path):
+    try:
+        result = import_questions(conn, QUESTIONS_JSON_PATH, dedup=QUESTION_DEDUP)
+    finally:
         conn.close()
-        return
+    print(f"Updated question text/formatting for existing questions "
+          f"({result['updated']} updated, {result['inserted']} new).")
 
-    with open(json_path, 'r') as f:
-        questions = json.load(f)
+def _questions_json_fingerprint() -> str:
+    if not os.path.exists(QUESTIONS_JSON_PATH):
+        return ""
+    digest = hashlib.sha256()
+    with open(QUESTIONS_JSON_PATH, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # We assume questions are indexed 1..N based on their order in JSON.
-    # This is a safe assumption if seeded sequentially and never deleted.
-    for index, q in enumerate(questions):
-        question_id = index + 1
-        cursor.execute("""
-            UPDATE questions 
-            SET question_text = ?, canonical_answer = ?, explanation = ?
-            WHERE id = ?
-        """, (q['question_text'], q['canonical_answer'], q['explanation'], question_id))
-    
-    conn.commit()
+def get_meta(key: str) -> Optional[str]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM app_meta WHERE key = ?", (key,))
+    row = cursor.fetchone()
     conn.close()
-    print("Updated question text/formatting for existing questions.")
+    return row[0] if row else None
+
+def set_meta(key: str, value: str):
+    conn = get_connection()
+    try:
+        conn.execute("""
+            INSERT INTO app_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, value))
+        conn.commit()
+    finally:
+        conn.close()
 
 def init_db():
     # ... (existing setup code)
     conn = get_connection()
     cursor = conn.cursor()
     # (tables creation code stays here)
+
+    # Small key/value store for boot bookkeeping (e.g. last applied questions.json hash)
+    cursor.execute("CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # LLM token/cost accounting (one row per OpenAI call)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            question_id INTEGER,
+            kind TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cached_tokens INTEGER NOT NULL DEFAULT 0,
+            cost_usd REAL NOT NULL DEFAULT 0,
+            latency_ms INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_user_day ON llm_usage (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_question ON llm_usage (question_id)")
+
+    # python-telegram-bot user/chat/conversation state (see persistence.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, key)
+        )
+    """)
+
+    # Nightly analytics summaries (see services/analytics_service.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_answered INTEGER NOT NULL,
+            total_correct INTEGER NOT NULL,
+            accuracy REAL NOT NULL,
+            current_streak INTEGER NOT NULL,
+            longest_streak INTEGER NOT NULL,
+            last_active TEXT,
+            computed_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_question_stats (
+            question_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            correct_rate REAL NOT NULL,
+            avg_confidence REAL NOT NULL,
+            computed_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_cohort_retention (
+            cohort_week TEXT NOT NULL,
+            week_offset INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            retention REAL NOT NULL,
+            computed_at TEXT NOT NULL,
+            PRIMARY KEY (cohort_week, week_offset)
+        )
+    """)
+
+    # Cold storage for old answer text (see services/archive_service.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_answers_archive (
+            user_question_id INTEGER PRIMARY KEY,
+            answer_blob BLOB NOT NULL,
+            archived_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Compact answered-question bitsets (see services/answered_bitmap.py)
+    # One row per (user, question): drop historical duplicates once, then enforce it
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_user_questions_user_question'")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            DELETE FROM user_questions
+            WHERE id NOT IN (SELECT MIN(id) FROM user_questions GROUP BY user_id, question_id)
+        """)
+        if cursor.rowcount:
+            print(f"Removed {cursor.rowcount} duplicate answers from user_questions.")
+        cursor.execute("CREATE UNIQUE INDEX idx_user_questions_user_question ON user_questions (user_id, question_id)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_answer_bitmaps (
+            user_id INTEGER PRIMARY KEY,
+            bitmap BLOB NOT NULL
+        )
+    """)
+
+    # Adaptive question queues: level, re-ask schedule and pending misses (see services/question_queue.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_question_queues (
+            user_id INTEGER NOT NULL,
+            track TEXT NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (user_id, track)
+        )
+    """)
     conn.commit()
     conn.close()
     
     # Seed data
     seed_questions()
     
-    # Update formatting for existing questions
-    update_existing_questions()
+    # Update formatting for existing questions, only when questions.json changed since the last boot
+    fingerprint = _questions_json_fingerprint()
+    if fingerprint and get_meta('questions_json_sha256') != fingerprint:
+        update_existing_questions()
+        set_meta('questions_json_sha256', fingerprint)
 
-def export_questions_to_json():
-    """Exports current DB questions to JSON for the 'questions.json' requirement."""
+def export_questions_to_json(path: str = QUESTIONS_JSON_PATH):
+    """Exports current DB questions to JSON for the 'questions.json' requirement (streamed row by row)."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT track, difficulty, question_text, canonical_answer, explanation FROM questions")
-    rows = cursor.fetchall()
-    
-    questions = []
-    for row in rows:
-        questions.append({
-            "track": row[0],
-            "difficulty": row[1],
-            "question_text": row[2],
-            "canonical_answer": row[3],
-            "explanation": row[4]
-        })
-        
-    json_path = os.path.join(os.path.dirname(__file__), 'data', 'questions.json')
-    with open(json_path, 'w') as f:
-        json.dump(questions, f, indent=2)
-    
-    conn.close()
+    try:
+        export_questions(conn, path)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     init_db()
@@ -1,8 +1,17 @@
+import asyncio
 import json
 import os
-import openai
+import re
+import sys
+import time
 from typing import Dict, Any, Optional
 
+from db import current_db_path
+from llm.tokens import DEFAULT_MODEL, count_message_tokens, count_tokens, truncate_to_tokens, estimate_cost
+from llm.resilience import AIMDLimiter, CircuitBreaker, CircuitOpenError, DeferredQueue, LoadShedError
+from services.coalescing import SingleFlight
+from services.usage_service import UsageService
+
 SYSTEM_PROMPT = """
 You are an expert Data Engineering mentor. Your task is to evaluate a student's answer to a technical question (SQL or Python).
 
@@ -32,68 +41,218 @@ Example Output:
 }
 """
 
+HINT_SYSTEM_PROMPT = """
+You are a helpful tutor. A student is stuck on the question in the next message.
+
+Provide a SHORT, helpful hint (max 1 sentence) that guides them towards the solution
+without giving it away explicitly.
+Use `backticks` for any code keywords or variables.
+"""
+
+# Per-user daily token budget across evaluations and hints (prompt + completion).
+DAILY_TOKEN_BUDGET = int(os.getenv("LLM_DAILY_TOKEN_BUDGET", "20000"))
+# User answers longer than this are truncated before being sent.
+MAX_ANSWER_TOKENS = int(os.getenv("LLM_MAX_ANSWER_TOKENS", "800"))
+EVAL_MAX_COMPLETION_TOKENS = 300
+HINT_MAX_COMPLETION_TOKENS = 80
+
+FALLBACK_HINT = "Review the concepts related to this topic."
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection errors, timeouts, 429 and 5xx; other API errors (4xx, bad JSON) would fail again."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    transient = (asyncio.TimeoutError, ConnectionError)
+    openai = sys.modules.get("openai")  # Imported with the client, see LLMEvaluator.client
+    if openai is not None:
+        transient += (openai.APIConnectionError,)
+    return isinstance(error, transient)
+
+
 class LLMEvaluator:
-    def __init__(self):
+    def __init__(self, usage_service: Optional[UsageService] = None):
         import logging
         self.logger = logging.getLogger(__name__)
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment.")
-        self.client = openai.AsyncClient(api_key=api_key)
+        self._api_key = api_key
+        self._client = None
+        self.model = DEFAULT_MODEL
+        self.usage_service = usage_service or UsageService()
+        # Guard the shared client: bounded adaptive concurrency + fail-fast when OpenAI is degraded
+        self.limiter = AIMDLimiter()
+        self.breaker = CircuitBreaker()
+        self.deferred = DeferredQueue(self.breaker)
+        # Identical concurrent requests (same user, question and answer) share one OpenAI call
+        self.single_flight = SingleFlight()
 
-    async def generate_hint(self, question_text: str, canonical_answer: str) -> str:
-        """
-        Generates a hint for the user without revealing the answer.
+    @property
+    def client(self):
+        # openai (and its httpx/pydantic stack) is imported on first use,
+        # keeping it off the startup path to the first poll
+        if self._client is None:
+            import openai
+            from transport import llm_http_client
+            self._client = openai.AsyncClient(api_key=self._api_key, http_client=llm_http_client())
+        return self._client
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.stats(),
+            "limiter": self.limiter.stats(),
+            "deferred": len(self.deferred),
+            "deferred_dropped": self.deferred.dropped_count,
+            "deferred_expired": self.deferred.expired_count,
+            "coalesced": self.single_flight.coalesced_count
+        }
+
+    def _remaining_budget(self, user_id: Optional[int]) -> int:
+        if user_id is None:
+            return DAILY_TOKEN_BUDGET
+        try:
+            return DAILY_TOKEN_BUDGET - self.usage_service.get_tokens_used_today(user_id)
+        except Exception as e:
+            # Accounting must never block evaluation
+            self.logger.warning(f"Could not read token usage for user {user_id}: {e}")
+            return DAILY_TOKEN_BUDGET
+
+    async def _complete(self, kind: str, messages, max_tokens: int, user_id: Optional[int],
+                        question_id: Optional[int], **kwargs) -> str:
         """
-        prompt = f"""
-        You are a helpful tutor. A student is stuck on this question:
-        
-        QUESTION: {question_text}
-        CANONICAL ANSWER: {canonical_answer}
-        
-        Provide a SHORT, helpful hint (max 1 sentence) that guides them towards the solution 
-        without giving it away explicitly. 
-        Use `backticks` for any code keywords or variables.
+        Runs a chat completion through the circuit breaker and concurrency limiter,
+        and records its tokens, cost and latency.
+        Raises CircuitOpenError / LoadShedError without calling OpenAI when shedding load.
         """
-        
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"retry in {self.breaker.retry_after():.0f}s")
+        try:
+            await self.limiter.acquire()
+        except LoadShedError:
+            # Not an upstream failure: give a half-open probe slot back
+            self.breaker.record_skipped()
+            raise
+
+        started = time.perf_counter()
+        success = False
         try:
             response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                timeout=30.0
+                model=self.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                timeout=30.0,
+                **kwargs
+            )
+            success = True
+        finally:
+            latency = time.perf_counter() - started
+            await self.limiter.release(latency, success)
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+        latency_ms = int(latency * 1000)
+
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or count_message_tokens(messages, self.model)
+        content = response.choices[0].message.content
+        completion_tokens = getattr(usage, "completion_tokens", None) or count_tokens(content, self.model)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+        try:
+            self.usage_service.record_usage(
+                kind, self.model, prompt_tokens, completion_tokens, cached_tokens,
+                estimate_cost(self.model, prompt_tokens, completion_tokens, cached_tokens),
+                latency_ms, user_id=user_id, question_id=question_id
             )
-            return response.choices[0].message.content.strip()
+        except Exception as e:
+            self.logger.warning(f"Could not record LLM usage: {e}")
+        return content
+
+    async def generate_hint(self, question_text: str, canonical_answer: str,
+                            user_id: Optional[int] = None, question_id: Optional[int] = None) -> str:
+        """
+        Generates a hint for the user without revealing the answer.
+        Falls back to a static hint once the user's daily token budget is spent.
+        """
+        # User and question ids are per database: scope the key to the active tenant's (see tenancy.py)
+        key = ("hint", current_db_path(), question_id or question_text, user_id)
+        return await self.single_flight.do(
+            key, lambda: self._generate_hint(question_text, canonical_answer, user_id, question_id)
+        )
+
+    async def _generate_hint(self, question_text: str, canonical_answer: str,
+                             user_id: Optional[int], question_id: Optional[int]) -> str:
+        messages = [
+            {"role": "system", "content": HINT_SYSTEM_PROMPT},
+            {"role": "user", "content": f"QUESTION: {question_text}\nCANONICAL ANSWER: {canonical_answer}"}
+        ]
+        needed = count_message_tokens(messages, self.model) + HINT_MAX_COMPLETION_TOKENS
+        if self._remaining_budget(user_id) < needed:
+            self.logger.info(f"Token budget exhausted for user {user_id}; serving static hint.")
+            return FALLBACK_HINT
+
+        try:
+            content = await self._complete("hint", messages, HINT_MAX_COMPLETION_TOKENS, user_id, question_id,
+                                           temperature=0.7)
+            return content.strip()
+        except (CircuitOpenError, LoadShedError) as e:
+            self.logger.info(f"Hint shed ({type(e).__name__}): {e}")
+            return FALLBACK_HINT
         except Exception as e:
             self.logger.error(f"Hint Generation Error: {e}", exc_info=True)
-            return "Review the concepts related to this topic."
+            return FALLBACK_HINT
 
-    async def evaluate_answer(self, question_text: str, canonical_answer: str, user_answer: str) -> Dict[str, Any]:
+    async def evaluate_answer(self, question_text: str, canonical_answer: str, user_answer: str,
+                              user_id: Optional[int] = None, question_id: Optional[int] = None) -> Dict[str, Any]:
         """
         Evaluates the user's answer using OpenAI.
         Returns a dictionary with is_correct, confidence, short_feedback, and hint.
+        Results not graded by the model (local check, error fallback) carry "fallback": True.
+
+        The system prompt and question/canonical answer come first so consecutive calls share
+        a stable prompt prefix; only the (truncated) user answer varies at the end.
+        When the daily token budget cannot cover the call, a local keyword check is used instead.
         """
-        user_prompt = f"""
+        key = ("evaluation", current_db_path(), question_id or question_text, user_id, (user_answer or "").strip())
+        result = await self.single_flight.do(
+            key, lambda: self._evaluate_answer(question_text, canonical_answer, user_answer, user_id, question_id)
+        )
+        return dict(result)
+
+    async def _evaluate_answer(self, question_text: str, canonical_answer: str, user_answer: str,
+                               user_id: Optional[int], question_id: Optional[int]) -> Dict[str, Any]:
+        answer = truncate_to_tokens(user_answer or "", MAX_ANSWER_TOKENS, self.model)
+        prefix = f"""
         QUESTION: {question_text}
         
         CANONICAL ANSWER: {canonical_answer}
-        
-        USER ANSWER: {user_answer}
         """
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"{prefix}\n        USER ANSWER: {answer}\n"}
+        ]
+
+        remaining = self._remaining_budget(user_id)
+        needed = count_message_tokens(messages, self.model) + EVAL_MAX_COMPLETION_TOKENS
+        if remaining < needed:
+            # Cheaper path 1: shrink the answer to whatever the budget still covers
+            spare = remaining - (needed - count_tokens(answer, self.model))
+            if spare < 100:
+                self.logger.info(f"Token budget exhausted for user {user_id}; using local evaluation.")
+                return self._local_evaluation(canonical_answer, answer)
+            answer = truncate_to_tokens(answer, spare, self.model)
+            messages[1]["content"] = f"{prefix}\n        USER ANSWER: {answer}\n"
 
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Or gpt-3.5-turbo depending on budget/preference
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
+            content = await self._complete(
+                "evaluation", messages, EVAL_MAX_COMPLETION_TOKENS, user_id, question_id,
                 temperature=0.0,
-                response_format={"type": "json_object"},
-                timeout=30.0
+                response_format={"type": "json_object"}
             )
-            
-            content = response.choices[0].message.content
             result = json.loads(content)
             
             # Enforce confidence threshold logic from requirements
@@ -102,12 +261,47 @@ class LLMEvaluator:
                 
             return result
 
+        except (CircuitOpenError, LoadShedError) as e:
+            self.logger.info(f"Evaluation deferred ({type(e).__name__}): {e}")
+            return {
+                "is_correct": False,
+                "confidence": 0.0,
+                "short_feedback": "The AI grader is busy right now. Your answer has been queued and you'll get the result shortly.",
+                "hint": None,
+                "deferred": True
+            }
+
         except Exception as e:
             self.logger.error(f"LLM Evaluation Error: {e}", exc_info=True)
-            # Fallback safe response
+            # Fallback safe response; a transient upstream failure is worth retrying
             return {
                 "is_correct": False,
                 "confidence": 0.0,
                 "short_feedback": "Unable to evaluate automatically. Please compare with the canonical answer.",
-                "hint": None
+                "hint": None,
+                "retryable": _is_transient(e),
+                "fallback": True
             }
+
+    def _local_evaluation(self, canonical_answer: str, user_answer: str) -> Dict[str, Any]:
+        """
+        Zero-cost feedback by keyword overlap with the canonical answer (budget fallback).
+        Never marks an answer correct: pasting every keyword would pass, so only the model grades.
+        """
+        def keywords(text):
+            return {w for w in re.findall(r'[a-z_][a-z0-9_]*', (text or "").lower()) if len(w) > 2}
+
+        expected = keywords(canonical_answer)
+        given = keywords(user_answer)
+        confidence = round(len(expected & given) / len(expected), 2) if expected else 0.0
+        if confidence >= 0.75:
+            feedback = "Daily AI review limit reached. Your answer seems to cover the key points - send it again tomorrow to get it graded."
+        else:
+            feedback = "Daily AI review limit reached, and some key points seem missing. Send your answer again tomorrow to get it graded."
+        return {
+            "is_correct": False,
+            "confidence": confidence,
+            "short_feedback": feedback,
+            "hint": None,
+            "fallback": True
+        }
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class LoadShedError(Exception):
+    """Raised when the limiter's wait queue is full and a request is rejected immediately."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and calls are short-circuited."""
+
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limiter (additive increase / multiplicative decrease).
+    Each fast, successful call grows the limit by ~1 per window of calls; a failure or a call
+    slower than latency_target halves it. Callers beyond the limit wait, up to max_queue of them.
+    """
+
+    def __init__(self, initial_limit: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 latency_target: float = 8.0, backoff: float = 0.5, max_queue: int = 32,
+                 queue_timeout: float = 10.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed_count = 0
+        self._condition = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so the limiter can be constructed outside a running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            if self.in_flight >= int(self.limit):
+                if self.waiting >= self.max_queue:
+                    self.shed_count += 1
+                    raise LoadShedError(f"{self.in_flight} in flight, {self.waiting} queued")
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: self.in_flight < int(self.limit)),
+                        timeout=self.queue_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.shed_count += 1
+                    raise LoadShedError("timed out waiting for a concurrency slot")
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+
+    async def release(self, latency: float, success: bool):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if success and latency <= self.latency_target:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "shed": self.shed_count
+        }
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+    After failure_threshold consecutive failures the circuit opens and calls fail fast.
+    Once reset_timeout has passed a single probe call is let through (half-open);
+    its success closes the circuit, its failure re-opens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.transitions = {self.OPEN: 0, self.HALF_OPEN: 0, self.CLOSED: 0}
+        self.rejected_count = 0
+
+    def _transition(self, new_state: str):
+        if new_state == self.state:
+            return
+        logger.warning(f"LLM circuit breaker: {self.state} -> {new_state}")
+        self.state = new_state
+        self.transitions[new_state] += 1
+        if new_state == self.OPEN:
+            self.opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may be attempted (0 when calls are allowed)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN and self.retry_after() == 0.0:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected_count += 1
+                return False
+            self._probe_in_flight = True
+            return True
+        if self.state == self.OPEN:
+            self.rejected_count += 1
+            return False
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self._transition(self.CLOSED)
+
+    def record_skipped(self):
+        """The allowed call never reached upstream; release a half-open probe slot without judging."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "transitions": dict(self.transitions),
+            "rejected": self.rejected_count
+        }
+
+
+class DeferredQueue:
+    """
+    Holds work shed while the circuit is open and replays it once calls are allowed again.
+    A job is an async callable taking `last_attempt` and returning True when done, or False to
+    be retried later (e.g. because it was deferred again); a job that is not done goes to the
+    back of the queue. On its max_attempts-th run last_attempt is True and the job must give up
+    (e.g. tell the user) instead of asking for another retry.
+    Jobs run in the context they were submitted from (context variables such as the active
+    tenant, see tenancy.py).
+    """
+
+    def __init__(self, breaker: CircuitBreaker, maxsize: int = 500, poll_interval: float = 5.0,
+                 max_attempts: int = 5):
+        self.breaker = breaker
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._jobs = deque()
+        self._drainer = None
+        self.dropped_count = 0
+        self.expired_count = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def submit(self, job: Callable[[bool], Awaitable[bool]]) -> bool:
+        """Queues a job; returns False if the queue is full and the job was dropped."""
+        if len(self._jobs) >= self.maxsize:
+            self.dropped_count += 1
+            return False
+        self._jobs.append((job, contextvars.copy_context(), 1))
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.get_running_loop().create_task(self._drain())
+        return True
+
+    async def _drain(self):
+        backoff = False
+        while self._jobs:
+            if backoff or self.breaker.state == CircuitBreaker.OPEN:
+                await asyncio.sleep(max(self.breaker.retry_after(), self.poll_interval))
+            job, context, attempt = self._jobs.popleft()
+            last_attempt = attempt >= self.max_attempts
+            try:
+                # A task created inside the submitter's context runs in a copy of it
+                done = await context.run(asyncio.ensure_future, job(last_attempt))
+            except Exception as e:
+                logger.error(f"Deferred job failed: {e}", exc_info=True)
+                done = True
+            if not done:
+                if last_attempt:
+                    self.expired_count += 1
+                    logger.warning(f"Deferred job gave up after {attempt} attempts")
+                else:
+                    # Behind the others, so one job that keeps failing doesn't hold up the queue
+                    self._jobs.append((job, context, attempt + 1))
+            backoff = not done
@@ -0,0 +1,79 @@
+import re
+from typing import Optional
+
+CHARS_PER_TOKEN = 4
+
+# USD per 1M tokens: (input, cached input, output)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+DEFAULT_MODEL = "gpt-4o-mini"
+
+_encoders = {}
+_tiktoken = None
+
+def _get_encoder(model: str):
+    # Optional dependency, imported on first count: exact BPE counts when tiktoken is installed,
+    # otherwise a cheap character-based estimate (~4 chars per token for English/code).
+    global _tiktoken
+    if _tiktoken is None:
+        try:
+            import tiktoken
+            _tiktoken = tiktoken
+        except ImportError:
+            _tiktoken = False
+    if _tiktoken is False:
+        return None
+    if model not in _encoders:
+        try:
+            _encoders[model] = _tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encoders[model] = _tiktoken.get_encoding("o200k_base")
+    return _encoders[model]
+
+def count_tokens(text: Optional[str], model: str = DEFAULT_MODEL) -> int:
+    """Counts tokens locally, without a network round trip."""
+    if not text:
+        return 0
+    encoder = _get_encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def count_message_tokens(messages, model: str = DEFAULT_MODEL) -> int:
+    """Approximates the prompt size of a chat completion request (content + per-message overhead)."""
+    return sum(count_tokens(m["content"], model) + 4 for m in messages) + 2
+
+def compact_whitespace(text: str) -> str:
+    """Collapses runs of blank lines and trailing spaces while keeping code indentation intact."""
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Shrinks text to roughly max_tokens by keeping its head and tail.
+    The start of an answer usually holds the approach and the end the final query/result,
+    so the middle is what gets dropped.
+    """
+    if not text:
+        return text
+    text = compact_whitespace(text)
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+
+    # Work in characters scaled by the measured chars/token ratio of this text.
+    ratio = len(text) / total
+    keep_chars = max(int(max_tokens * ratio) - 40, 0)
+    head = text[:keep_chars * 2 // 3]
+    tail = text[len(text) - keep_chars // 3:] if keep_chars // 3 else ""
+    omitted = total - count_tokens(head + tail, model)
+    return f"{head}\n[... {omitted} tokens omitted ...]\n{tail}"
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Returns the USD cost of a call based on MODEL_PRICING."""
+    input_price, cached_price, output_price = MODEL_PRICING.get(model, MODEL_PRICING[DEFAULT_MODEL])
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
@@ -5,9 +5,14 @@ load_dotenv()
 
 import asyncio
 import logging
+import signal
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from telegram import Update
+from telegram.ext import TypeHandler
 from db import init_db
 from telegram_bot import create_app, user_service, quiz_service
 from scheduler import DailyQuizScheduler
+from tenancy import load_tenants
 
 # Configure logging
 logging.basicConfig(
@@ -19,6 +24,10 @@ def main():
     # 1. Initialize DB
     print("Initializing Database...")
     init_db()
+    # Parse the formatted question catalog off the startup path
+    quiz_service.warm_catalog()
+    # Rank structure for /leaderboard, rebuilt from SQLite and then maintained incrementally
+    quiz_service.leaderboard.rebuild()
     
     # 2. Create Bot Application
     print("Creating Bot Application...")
@@ -34,11 +43,70 @@ def main():
     print("Bot is polling...")
     application.run_polling()
 
+def log_tenant_metrics(tenants):
+    for tenant in tenants:
+        logging.info(f"Tenant metrics: {tenant.snapshot()}")
+
+async def run_tenants(tenants):
+    """
+    Runs several bots on one event loop (TELEGRAM_BOT_TOKENS, see tenancy.py): each tenant is
+    initialized and started with its database and services active, then one scheduler drives
+    all of them until SIGINT/SIGTERM.
+    """
+    scheduler = AsyncIOScheduler()
+    started = []
+    try:
+        for index, tenant in enumerate(tenants):
+            # Tasks started in here (polling, update processing, persistence) keep this tenant active
+            with tenant.activate():
+                print(f"Starting bot '{tenant.name}' (database {tenant.db_path})...")
+                init_db()
+                tenant.quiz_service.warm_catalog()
+                tenant.quiz_service.leaderboard.rebuild()
+
+                application = create_app(tenant.token)
+                application.add_handler(TypeHandler(Update, tenant.count_update), group=-2)
+                application.add_error_handler(tenant.record_error)
+                tenant.application = application
+
+                await application.initialize()
+                if application.post_init:
+                    await application.post_init(application)
+                await application.updater.start_polling()
+                await application.start()
+                started.append(tenant)
+
+                # Spread the tenants' 10-minute dispatch runs across the interval
+                DailyQuizScheduler(application, tenant.user_service, tenant.quiz_service,
+                                   scheduler=scheduler, tenant=tenant,
+                                   offset_minutes=index * 10 // len(tenants)).start()
+
+        scheduler.add_job(log_tenant_metrics, 'interval', minutes=10, args=[tenants], id="tenant-metrics")
+        scheduler.start()
+        print(f"{len(started)} bots are polling...")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        for tenant in reversed(started):
+            with tenant.activate():
+                application = tenant.application
+                await application.updater.stop()
+                await application.stop()
+                await application.shutdown()
+
 if __name__ == "__main__":
     # Ensure env vars are set
-    if not os.getenv("TELEGRAM_BOT_TOKEN"):
-        print("Error: TELEGRAM_BOT_TOKEN is not set.")
+    if not os.getenv("TELEGRAM_BOT_TOKEN") and not os.getenv("TELEGRAM_BOT_TOKENS"):
+        print("Error: TELEGRAM_BOT_TOKEN (or TELEGRAM_BOT_TOKENS) is not set.")
     elif not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY is not set.")
+    elif os.getenv("TELEGRAM_BOT_TOKENS"):
+        asyncio.run(run_tenants(load_tenants()))
     else:
         main()
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+USER = "user"
+CHAT = "chat"
+BOT = "bot"
+CONVERSATION = "conversation:"
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Durable python-telegram-bot state (user_data, chat_data, conversations) in the bot's SQLite DB.
+
+    Writes are write-behind: update_* calls only stage a JSON snapshot when it differs from what
+    was last stored (dirty tracking), and staged rows are written together in one transaction on a
+    worker thread. The Application already calls update_* for touched users every update_interval
+    seconds, so nothing is written synchronously on the update path. flush() drains the rest on shutdown.
+
+    bot_data and arbitrary callback data hold live objects rather than plain state, so they are
+    not persisted by default. Values must be JSON-serializable; anything else is skipped with a warning.
+    """
+
+    def __init__(self, update_interval: float = 10,
+                 store_data: Optional[PersistenceInput] = None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self._snapshots: Dict[Tuple[str, str], str] = {}  # last JSON stored per (kind, key)
+        self._pending: Dict[Tuple[str, str], Optional[str]] = {}  # None = delete
+        self._flush_task = None
+
+    # --- storage -----------------------------------------------------------
+
+    def _load(self, kind: str) -> Dict[str, Any]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, data FROM bot_persistence WHERE kind = ?", (kind,))
+        rows = cursor.fetchall()
+        conn.close()
+        for key, data in rows:
+            self._snapshots[(kind, key)] = data
+        return {key: json.loads(data) for key, data in rows}
+
+    def _write(self, batch: Dict[Tuple[str, str], Optional[str]]):
+        conn = get_connection()
+        try:
+            conn.executemany("""
+                INSERT INTO bot_persistence (kind, key, data) VALUES (?, ?, ?)
+                ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = CURRENT_TIMESTAMP
+            """, [(kind, key, data) for (kind, key), data in batch.items() if data is not None])
+            conn.executemany("DELETE FROM bot_persistence WHERE kind = ? AND key = ?",
+                             [item for item, data in batch.items() if data is None])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _stage(self, kind: str, key: str, data: Any):
+        item = (kind, key)
+        if data is None:
+            payload = None
+        else:
+            try:
+                payload = json.dumps(data, sort_keys=True)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Not persisting {kind} {key}: {e}")
+                return
+        if item not in self._pending and self._snapshots.get(item) == payload:
+            return  # Unchanged since last write
+        self._pending[item] = payload
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Yield once so the rest of the Application's persistence sweep lands in the same batch
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                logger.error(f"Persistence write failed, will retry: {e}", exc_info=True)
+                # Keep newer staged values, re-stage the failed ones underneath
+                self._pending = {**batch, **self._pending}
+                return
+            for item, payload in batch.items():
+                if payload is None:
+                    self._snapshots.pop(item, None)
+                else:
+                    self._snapshots[item] = payload
+
+    # --- BasePersistence API -----------------------------------------------
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(k): v for k, v in (await asyncio.to_thread(self._load, USER)).items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {int(k): v for k, v in (await asyncio.to_thread(self._load, CHAT)).items()}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return (await asyncio.to_thread(self._load, BOT)).get(BOT, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        stored = await asyncio.to_thread(self._load, CONVERSATION + name)
+        return {tuple(json.loads(k)): state for k, state in stored.items()}
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]):
+        self._stage(CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]):
+        self._stage(USER, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]):
+        self._stage(CHAT, str(chat_id), data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]):
+        self._stage(BOT, BOT, data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        self._stage(CHAT, str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int):
+        self._stage(USER, str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write, batch)
@@ -0,0 +1,212 @@
+"""
+Runtime profiling hooks, toggled by the admin /profile command.
+
+- cProfile ("cpu") or a sampling profiler ("sample") for a time window or the next N updates.
+  cProfile output is a .pstats file (snakeviz, gprof2dot, `python -m pstats`); the sampler
+  writes collapsed stacks (.folded) for flamegraph.pl / speedscope.
+- A stall detector: a heartbeat task on the event loop plus a watchdog thread that logs the
+  loop thread's stack whenever a callback blocks the loop longer than a threshold
+  (typically sync SQLite calls or CPU-bound work inside a handler).
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from db import DB_PATH
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(DB_PATH), "profiles"))
+SAMPLE_INTERVAL = 0.005
+MAX_WINDOW_SECONDS = 600  # Upper bound for "next N updates" sessions
+
+
+def _format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapsed_stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        frames.append(_format_frame(frame))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class _Sampler(threading.Thread):
+    """Samples another thread's stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, target_thread_id: int, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is not None:
+                self.stacks[_collapsed_stack(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RuntimeProfiler:
+    """One profiling session at a time, bounded by a time window or an update count."""
+
+    def __init__(self):
+        self.mode = None
+        self.started_at = 0.0
+        self.updates_left = None
+        self._profile = None
+        self._sampler = None
+        self._timer = None
+        self._on_finish = None
+
+    @property
+    def active(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str, seconds: Optional[float] = None, updates: Optional[int] = None,
+              on_finish: Optional[Callable[[str], Awaitable[None]]] = None):
+        """
+        Starts profiling on the running loop's thread. Ends after `seconds`, or after
+        `updates` further updates (capped at MAX_WINDOW_SECONDS). on_finish gets the output path.
+        """
+        if self.active:
+            raise RuntimeError(f"A {self.mode} profile is already running.")
+        if mode not in ("cpu", "sample"):
+            raise ValueError("mode must be 'cpu' or 'sample'")
+
+        loop = asyncio.get_running_loop()
+        self.mode = mode
+        self.started_at = time.monotonic()
+        self.updates_left = updates
+        self._on_finish = on_finish
+        self._timer = loop.call_later(seconds or MAX_WINDOW_SECONDS, self._finish)
+        if mode == "cpu":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = _Sampler(threading.get_ident())
+            self._sampler.start()
+        logger.warning(f"Profiling started: {mode}, seconds={seconds}, updates={updates}")
+
+    def count_update(self):
+        """Called once per incoming update; ends an update-bounded session when the budget is used."""
+        if self.active and self.updates_left is not None:
+            self.updates_left -= 1
+            if self.updates_left < 0:
+                self._finish()
+
+    def stop(self) -> Optional[str]:
+        return self._finish() if self.active else None
+
+    def _finish(self) -> Optional[str]:
+        if not self.active:
+            return None
+        if self._timer is not None:
+            self._timer.cancel()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        if self.mode == "cpu":
+            self._profile.disable()
+            path = os.path.join(PROFILE_DIR, f"profile-{stamp}.pstats")
+            self._profile.dump_stats(path)
+        else:
+            self._sampler.stop()
+            path = os.path.join(PROFILE_DIR, f"profile-{stamp}.folded")
+            with open(path, "w") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        duration = time.monotonic() - self.started_at
+        logger.warning(f"Profiling finished after {duration:.1f}s: {path}")
+        on_finish = self._on_finish
+        self.mode = None
+        self._profile = self._sampler = self._timer = self._on_finish = None
+        self.updates_left = None
+        if on_finish is not None:
+            asyncio.get_running_loop().create_task(on_finish(path))
+        return path
+
+
+class StallDetector:
+    """
+    Logs event-loop stalls: a heartbeat coroutine stamps the time every `interval`; a watchdog
+    thread notices when the stamp is older than `threshold` and logs the loop thread's stack
+    (the code that is blocking), then logs the total stall time once the loop recovers.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.stall_count = 0
+        self.longest_stall = 0.0
+        self._last_beat = 0.0
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._watchdog = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat_task is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop_event.clear()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.warning(f"Stall detection on (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._heartbeat_task.cancel()
+        self._heartbeat_task = None
+        self._stop_event.set()
+        self._watchdog.join()
+        logger.warning("Stall detection off")
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stop_event.wait(self.interval / 2):
+            lag = time.monotonic() - self._last_beat - self.interval
+            if lag > self.threshold and stalled_since is None:
+                stalled_since = self._last_beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+                logger.warning(f"Event loop blocked for >{self.threshold * 1000:.0f} ms in:\n{stack}")
+            elif lag <= self.threshold and stalled_since is not None:
+                duration = self._last_beat - stalled_since
+                self.stall_count += 1
+                self.longest_stall = max(self.longest_stall, duration)
+                logger.warning(f"Event loop stall ended after {duration * 1000:.0f} ms")
+                stalled_since = None
+
+
+runtime_profiler = RuntimeProfiler()
+stall_detector = StallDetector(threshold=float(os.getenv("STALL_THRESHOLD_MS", "250")) / 1000)
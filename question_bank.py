@@ -0,0 +1,249 @@
+"""
+Streaming import/export of the question bank.
+
+Questions are matched by a stable key instead of their position in the file:
+an explicit "key" field when present, otherwise a hash of the track and the
+normalized question text (so formatting-only edits still hit the same row).
+Rewording a question without a key would insert a new row, so data/questions.json
+carries explicit keys (as export_questions writes them): keep them when editing.
+Files are read and written incrementally, so memory stays flat for large banks.
+"""
+import hashlib
+import json
+from itertools import islice
+from typing import Any, Dict, Iterator, Optional
+
+CHUNK_SIZE = 5000
+READ_BUFFER = 1 << 16
+
+QUESTION_FIELDS = ("track", "difficulty", "question_text", "canonical_answer", "explanation")
+
+
+def normalize_question_text(text: Optional[str]) -> str:
+    """Standardizes text for matching: lower case, no backticks, single spaces."""
+    if not text: return ""
+    # split/join collapses whitespace runs like re.sub(r'\s+', ' ') but much faster on bulk imports
+    return ' '.join(text.replace('`', '').split()).lower()
+
+
+def question_key(track: str, question_text: str) -> str:
+    payload = f"{track}\x1f{normalize_question_text(question_text)}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def iter_questions(path: str) -> Iterator[Dict[str, Any]]:
+    """Yields questions one at a time from a JSON array or a JSON Lines file."""
+    if path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = f.read(READ_BUFFER)
+        pos = 0
+        # Skip up to and including the opening bracket
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos < len(buffer):
+                break
+            more = f.read(READ_BUFFER)
+            if not more:
+                return
+            buffer, pos = more, 0
+        if buffer[pos] != "[":
+            raise ValueError(f"{path}: expected a JSON array of questions")
+        pos += 1
+
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos < len(buffer) and buffer[pos] == ",":
+                pos = _skip_whitespace(buffer, pos + 1)
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Object cut off at the end of the buffer: read more and retry
+                more = f.read(READ_BUFFER)
+                if not more:
+                    raise
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield item
+            pos = end
+            if pos > READ_BUFFER:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def _skip_whitespace(buffer: str, pos: int) -> int:
+    length = len(buffer)
+    while pos < length and buffer[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+
+def ensure_question_keys(conn):
+    """Adds the question_key column + unique index and backfills keys for existing rows."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(questions)")
+    if "question_key" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE questions ADD COLUMN question_key TEXT")
+
+    cursor.execute("SELECT id, track, question_text FROM questions WHERE question_key IS NULL ORDER BY id")
+    rows = cursor.fetchall()
+    if rows:
+        cursor.execute("SELECT question_key FROM questions WHERE question_key IS NOT NULL")
+        taken = {r[0] for r in cursor.fetchall()}
+        updates = []
+        for question_id, track, text in rows:
+            key = question_key(track, text)
+            if key in taken:
+                # Near-identical duplicate already in the bank; leave it unkeyed
+                print(f"Warning: question {question_id} duplicates an existing question; not keyed.")
+                continue
+            taken.add(key)
+            updates.append((key, question_id))
+        cursor.executemany("UPDATE questions SET question_key = ? WHERE id = ?", updates)
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_key ON questions (question_key)")
+    conn.commit()
+
+
+def import_questions(conn, path: str, chunk_size: int = CHUNK_SIZE, update_existing: bool = True,
+                     dedup: Optional[str] = None) -> Dict[str, int]:
+    """
+    Upserts questions from path by stable key, chunk_size rows per executemany/transaction.
+    With update_existing=False, rows whose key already exists are left untouched.
+    dedup="warn" reports questions that are near-duplicates of another question in the same
+    track (in the DB or earlier in the file); dedup="skip" also leaves them out.
+    Returns counts of rows read, inserted, updated and flagged as near-duplicates.
+    """
+    ensure_question_keys(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM questions")
+    before = cursor.fetchone()[0]
+
+    if update_existing:
+        sql = """
+            INSERT INTO questions (question_key, track, difficulty, question_text, canonical_answer, explanation)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(question_key) DO UPDATE SET
+                difficulty = excluded.difficulty,
+                question_text = excluded.question_text,
+                canonical_answer = excluded.canonical_answer,
+                explanation = excluded.explanation
+        """
+    else:
+        sql = """
+            INSERT OR IGNORE INTO questions (question_key, track, difficulty, question_text, canonical_answer, explanation)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+
+    indexes = _track_indexes(conn) if dedup else None
+    read = written = near_duplicates = 0
+    rows = (
+        (q.get("key") or question_key(q["track"], q["question_text"]),
+         q["track"], q["difficulty"], q["question_text"], q["canonical_answer"], q["explanation"])
+        for q in iter_questions(path)
+    )
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        read += len(chunk)
+        if indexes is not None:
+            chunk, flagged = _check_near_duplicates(indexes, chunk, skip=dedup == "skip")
+            near_duplicates += flagged
+        cursor.executemany(sql, chunk)
+        conn.commit()
+        written += len(chunk)
+
+    cursor.execute("SELECT COUNT(*) FROM questions")
+    inserted = cursor.fetchone()[0] - before
+    return {"read": read, "inserted": inserted, "updated": written - inserted if update_existing else 0,
+            "near_duplicates": near_duplicates}
+
+
+def _track_indexes(conn):
+    """Near-duplicate indexes of the questions already stored, one per track, keyed by question key."""
+    # Imported here: services.dedup_index itself imports this module
+    from services.dedup_index import MinHashIndex
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT question_key, track, question_text FROM questions WHERE question_key IS NOT NULL")
+    indexes = {}
+    for key, track, text in cursor.fetchall():
+        indexes.setdefault(track, []).append((key, text))
+    for track, items in indexes.items():
+        indexes[track] = MinHashIndex()
+        indexes[track].add_many(items)
+    return indexes
+
+
+def _check_near_duplicates(indexes, chunk, skip: bool):
+    """Flags rows similar to a differently-keyed question of the same track; returns (rows to write, flagged)."""
+    from services.dedup_index import MinHashIndex, fingerprints
+
+    kept = []
+    flagged = 0
+    for row, fingerprint in zip(chunk, fingerprints([row[3] for row in chunk])):
+        key, track, text = row[0], row[1], row[3]
+        index = indexes.setdefault(track, MinHashIndex())
+        matches = [(other, similarity) for other, similarity in index.match(fingerprint) if other != key]
+        if matches:
+            flagged += 1
+            other, similarity = matches[0]
+            snippet = " ".join(text.split())[:60]
+            print(f"Warning: {track} question \"{snippet}\" is a near-duplicate of question key {other} "
+                  f"(similarity {similarity:.2f}){'; skipped' if skip else ''}.")
+            if skip:
+                continue
+        index.add_fingerprint(key, fingerprint)
+        kept.append(row)
+    return kept, flagged
+
+
+def export_questions(conn, path: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Streams the questions table to path (JSON array, or JSON Lines for *.jsonl),
+    fetching chunk_size rows at a time. Returns the number of questions written.
+    """
+    jsonl = path.endswith(".jsonl")
+    cursor = conn.cursor()
+    cursor.execute("SELECT question_key, track, difficulty, question_text, canonical_answer, explanation "
+                   "FROM questions ORDER BY id")
+    count = 0
+    with open(path, "w") as f:
+        if not jsonl:
+            f.write("[")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                item = dict(zip(QUESTION_FIELDS, row[1:]))
+                if row[0]:
+                    item["key"] = row[0]
+                if jsonl:
+                    f.write(json.dumps(item) + "\n")
+                else:
+                    f.write(("," if count else "") + "\n  " + _format_indented(item))
+                count += 1
+        if not jsonl:
+            f.write("\n]" if count else "]")
+    return count
+
+
+def _format_indented(item: Dict[str, Any]) -> str:
+    """
+    Lays out a flat question dict exactly like json.dump(list, indent=2) would as a list element.
+    indent= forces json's pure-Python encoder; encoding each scalar separately keeps the C fast path.
+    """
+    fields = ",\n".join(f"    {json.dumps(k)}: {json.dumps(v)}" for k, v in item.items())
+    return "{\n" + fields + "\n  }"
@@ -1,25 +1,76 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from services.user_service import UserService
 from services.quiz_service import QuizService
-from datetime import datetime
+from services.archive_service import ArchiveService
+from services.analytics_service import AnalyticsService
+from datetime import datetime, timedelta
 import asyncio
+from typing import Optional
 from telegram.ext import Application
 
 class DailyQuizScheduler:
-    def __init__(self, application: Application, user_service: UserService, quiz_service: QuizService):
+    """
+    Daily quiz dispatch plus nightly/weekly maintenance for one bot.
+
+    When several bots share the process (see tenancy.py), each tenant gets its own
+    DailyQuizScheduler on one shared AsyncIOScheduler: jobs are named per tenant, run with the
+    tenant active (its database and services), and are offset by offset_minutes so the
+    tenants' send bursts and maintenance don't all start at once.
+    """
+    def __init__(self, application: Application, user_service: UserService, quiz_service: QuizService,
+                 scheduler: Optional[AsyncIOScheduler] = None, tenant=None, offset_minutes: int = 0):
         self.application = application
         self.user_service = user_service
         self.quiz_service = quiz_service
-        self.scheduler = AsyncIOScheduler()
+        self.archive_service = ArchiveService()
+        self.analytics_service = AnalyticsService()
+        self.scheduler = scheduler or AsyncIOScheduler()
+        self._owns_scheduler = scheduler is None
+        self.tenant = tenant
+        self.offset_minutes = offset_minutes
+
+    def _job(self, coro_fn):
+        if self.tenant is None:
+            return coro_fn
+        async def run():
+            with self.tenant.activate():
+                await coro_fn()
+        return run
 
     def start(self):
+        prefix = f"{self.tenant.name}:" if self.tenant else ""
+        offset = self.offset_minutes
         # Run every 10 minutes to check if users need a question
         # For testing, we can make this more frequent, but 10m is reasonable for "Daily"
         # In production, maybe run at specific UTC time.
         # We will use an interval here to ensure we catch up if bot was down.
-        self.scheduler.add_job(self.send_daily_quizzes, 'interval', minutes=10)
-        self.scheduler.start()
-        print("Scheduler started.")
+        self.scheduler.add_job(self._job(self.send_daily_quizzes), 'interval', minutes=10,
+                               start_date=datetime.now() + timedelta(minutes=offset),
+                               id=f"{prefix}daily-quizzes")
+        # Nightly: recompute streak/accuracy/difficulty/cohort summaries for admin views
+        self.scheduler.add_job(self._job(self.run_nightly_analytics), 'cron', hour=2, minute=offset % 60,
+                               id=f"{prefix}nightly-analytics")
+        # Weekly: move old answer text to compressed cold storage and VACUUM
+        self.scheduler.add_job(self._job(self.run_storage_maintenance), 'cron', day_of_week='sun',
+                               hour=3, minute=(30 + offset) % 60, id=f"{prefix}storage-maintenance")
+        if self._owns_scheduler:
+            self.scheduler.start()
+        print(f"Scheduler started{' for ' + self.tenant.name if self.tenant else ''}.")
+
+    async def run_nightly_analytics(self):
+        print("Running nightly analytics job...")
+        try:
+            await asyncio.to_thread(self.analytics_service.run_nightly)
+        except Exception as e:
+            print(f"Nightly analytics failed: {e}")
+
+    async def run_storage_maintenance(self):
+        print("Running storage maintenance job...")
+        try:
+            # Sync SQLite work (VACUUM rewrites the whole file); keep it off the event loop
+            await asyncio.to_thread(self.archive_service.run_maintenance)
+        except Exception as e:
+            print(f"Storage maintenance failed: {e}")
 
     async def send_daily_quizzes(self):
         print("Running daily quiz job...")
@@ -66,6 +117,9 @@ class DailyQuizScheduler:
                         text=message_text,
                         parse_mode="Markdown"
                     )
+                    self.quiz_service.mark_question_sent(user.id, question.id)
+                    if self.tenant:
+                        self.tenant.metrics["quizzes_sent"] += 1
                     
                     # Small delay between messages
                     await asyncio.sleep(0.5)
@@ -75,5 +129,7 @@ class DailyQuizScheduler:
                 
             except Exception as e:
                 print(f"Failed to send quiz to user {user.telegram_id}: {e}")
+                if self.tenant:
+                    self.tenant.metrics["quiz_send_failures"] += 1
                 # In real app, handle 'user blocked bot' here (Forbidden error)
                 # and mark user as inactive.
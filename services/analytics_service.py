@@ -0,0 +1,298 @@
+import time
+from itertools import chain
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from db import get_connection
+
+# numpy is imported inside the batch functions: the service is created when the bot module is
+# imported, but only the nightly job needs it
+
+FETCH_CHUNK = 200_000
+EPOCH = date(1970, 1, 1)
+MIN_ATTEMPTS_FOR_DIFFICULTY = 3
+
+
+def _day_to_str(day: int) -> str:
+    return (EPOCH + timedelta(days=int(day))).isoformat()
+
+
+def _factorize(ids: "np.ndarray"):
+    """
+    np.unique(ids, return_inverse=True) for small non-negative integer ids, via bincount
+    (linear time; np.unique sorts or hashes, which dominates at millions of rows).
+    """
+    import numpy as np
+
+    if not len(ids):
+        return ids, ids
+    if ids.max() > 4 * len(ids) + 1_000_000:
+        # Sparse/huge ids (e.g. Telegram ids): a dense bincount would be too large
+        return np.unique(ids, return_inverse=True)
+    present = np.bincount(ids) > 0
+    uniques = np.flatnonzero(present)
+    positions = np.cumsum(present) - 1
+    return uniques, positions[ids]
+
+
+def _sorted_unique(values: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+
+def _week_of(days: "np.ndarray") -> "np.ndarray":
+    # 1970-01-01 was a Thursday; shift so weeks start on Monday
+    return (days + 3) // 7
+
+
+class AnalyticsService:
+    """
+    Nightly batch analytics over user_questions.
+    The table is read once into columnar NumPy arrays and every metric is computed with
+    vectorized group-bys (sort + bincount/reduceat); results go to analytics_* summary tables
+    that admin commands read without touching the raw answers.
+    """
+
+    def load_answers(self) -> "Dict[str, np.ndarray]":
+        """
+        One scan of user_questions into column arrays (day = days since 1970-01-01).
+        Row materialization dominates at millions of rows, so SQLite packs each row into two
+        integers (ids + correctness, day + confidence in thousandths) that NumPy unpacks.
+        Confidence is clamped to [0, 1] so it stays within its 10 bits.
+        """
+        import numpy as np
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT (user_id << 24) | (question_id << 1) | (answered_correctly != 0),
+                   (CAST(julianday(answered_at) - 2440587.5 AS INTEGER) << 10)
+                       | CAST(ROUND(MAX(0, MIN(1, COALESCE(llm_confidence, 0))) * 1000) AS INTEGER)
+            FROM user_questions
+        """)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            chunks.append(np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)))
+        conn.close()
+
+        packed = np.concatenate(chunks).reshape(-1, 2) if chunks else np.zeros((0, 2), np.int64)
+        ids, day_conf = packed[:, 0], packed[:, 1]
+        return {
+            "user_id": ids >> 24,
+            "question_id": (ids >> 1) & 0x7FFFFF,
+            "correct": ids & 1,
+            "confidence": (day_conf & 0x3FF) / 1000.0,
+            "day": day_conf >> 10,
+        }
+
+    def compute_user_stats(self, cols: "Dict[str, np.ndarray]", today: date) -> "Dict[str, np.ndarray]":
+        import numpy as np
+
+        users, inverse = _factorize(cols["user_id"])
+        total = np.bincount(inverse, minlength=len(users))
+        correct = np.bincount(inverse, weights=cols["correct"], minlength=len(users)).astype(np.int64)
+        accuracy = np.round(np.divide(correct * 100.0, total, out=np.zeros(len(users)), where=total > 0), 2)
+
+        # Distinct (user, day) pairs, sorted by user then day
+        span = int(cols["day"].max()) + 2 if len(cols["day"]) else 1
+        pairs = _sorted_unique(inverse.astype(np.int64) * span + cols["day"])
+        pair_user, pair_day = pairs // span, pairs % span
+
+        # A run of consecutive days breaks on a new user or a gap of more than one day
+        breaks = np.ones(len(pairs), dtype=bool)
+        breaks[1:] = (pair_user[1:] != pair_user[:-1]) | (pair_day[1:] != pair_day[:-1] + 1)
+        run_starts = np.flatnonzero(breaks)
+        run_lengths = np.diff(np.append(run_starts, len(pairs)))
+        run_user = pair_user[run_starts]
+
+        # Per user: first run index, last run index
+        user_first_run = np.searchsorted(run_user, np.arange(len(users)), side="left")
+        user_last_run = np.searchsorted(run_user, np.arange(len(users)), side="right") - 1
+        longest = np.maximum.reduceat(run_lengths, user_first_run) if len(run_lengths) else np.zeros(0, np.int64)
+
+        last_day = pair_day[np.append(run_starts[1:], len(pairs)) - 1][user_last_run]
+        today_day = (today - EPOCH).days
+        current = np.where(last_day >= today_day - 1, run_lengths[user_last_run], 0)
+
+        first_day = pair_day[run_starts[user_first_run]]
+        return {
+            "user_id": users,
+            "total": total,
+            "correct": correct,
+            "accuracy": accuracy,
+            "current_streak": current,
+            "longest_streak": longest,
+            "first_day": first_day,
+            "last_day": last_day,
+            "_pairs": (pair_user, pair_day),
+        }
+
+    def compute_question_stats(self, cols: "Dict[str, np.ndarray]") -> "Dict[str, np.ndarray]":
+        import numpy as np
+
+        questions, inverse = _factorize(cols["question_id"])
+        attempts = np.bincount(inverse, minlength=len(questions))
+        correct = np.bincount(inverse, weights=cols["correct"], minlength=len(questions))
+        confidence = np.bincount(inverse, weights=cols["confidence"], minlength=len(questions))
+        return {
+            "question_id": questions,
+            "attempts": attempts,
+            "correct_rate": np.round(correct / np.maximum(attempts, 1), 4),
+            "avg_confidence": np.round(confidence / np.maximum(attempts, 1), 4),
+        }
+
+    def compute_cohorts(self, user_stats: "Dict[str, np.ndarray]") -> "Dict[str, np.ndarray]":
+        """Weekly retention: share of each first-activity-week cohort active N weeks later."""
+        import numpy as np
+
+        pair_user, pair_day = user_stats["_pairs"]
+        if not len(pair_user):
+            empty = np.zeros(0, np.int64)
+            return {"cohort_week": empty, "week_offset": empty, "users": empty, "retention": np.zeros(0)}
+
+        cohort = _week_of(user_stats["first_day"])
+        # Distinct (user, active week) pairs, then offset from the user's cohort week
+        base = int(pair_day.max()) + 7
+        weeks = _sorted_unique(pair_user * base + _week_of(pair_day))
+        week_user = weeks // base
+        offset = weeks % base - cohort[week_user]
+
+        cohort_ids, cohort_inverse = _factorize(cohort[week_user])
+        max_offset = int(offset.max()) + 1
+        counts = np.bincount(cohort_inverse * max_offset + offset,
+                             minlength=len(cohort_ids) * max_offset).reshape(len(cohort_ids), max_offset)
+        sizes = counts[:, 0]
+        cohort_idx, offsets = np.nonzero(counts)
+        return {
+            "cohort_week": cohort_ids[cohort_idx],
+            "week_offset": offsets,
+            "users": counts[cohort_idx, offsets],
+            "retention": np.round(counts[cohort_idx, offsets] / sizes[cohort_idx], 4),
+        }
+
+    def save(self, user_stats, question_stats, cohorts):
+        computed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM analytics_user_stats")
+            cursor.executemany("""
+                INSERT INTO analytics_user_stats (user_id, total_answered, total_correct, accuracy,
+                    current_streak, longest_streak, last_active, computed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, zip(user_stats["user_id"].tolist(), user_stats["total"].tolist(), user_stats["correct"].tolist(),
+                     user_stats["accuracy"].tolist(), user_stats["current_streak"].tolist(),
+                     user_stats["longest_streak"].tolist(), map(_day_to_str, user_stats["last_day"].tolist()),
+                     [computed_at] * len(user_stats["user_id"])))
+
+            cursor.execute("DELETE FROM analytics_question_stats")
+            cursor.executemany("""
+                INSERT INTO analytics_question_stats (question_id, attempts, correct_rate, avg_confidence, computed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, zip(question_stats["question_id"].tolist(), question_stats["attempts"].tolist(),
+                     question_stats["correct_rate"].tolist(), question_stats["avg_confidence"].tolist(),
+                     [computed_at] * len(question_stats["question_id"])))
+
+            cursor.execute("DELETE FROM analytics_cohort_retention")
+            cursor.executemany("""
+                INSERT INTO analytics_cohort_retention (cohort_week, week_offset, users, retention, computed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, zip(map(lambda w: _day_to_str(w * 7 - 3), cohorts["cohort_week"].tolist()),
+                     cohorts["week_offset"].tolist(), cohorts["users"].tolist(), cohorts["retention"].tolist(),
+                     [computed_at] * len(cohorts["cohort_week"])))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def run_nightly(self, today: Optional[date] = None) -> Dict[str, float]:
+        """Full recompute: load, compute, write summaries. Returns row counts and timings."""
+        today = today or datetime.now().date()
+        timings = {}
+
+        started = time.perf_counter()
+        cols = self.load_answers()
+        timings["load_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        user_stats = self.compute_user_stats(cols, today)
+        question_stats = self.compute_question_stats(cols)
+        cohorts = self.compute_cohorts(user_stats)
+        timings["compute_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.save(user_stats, question_stats, cohorts)
+        timings["save_s"] = time.perf_counter() - started
+
+        result = {"rows": len(cols["user_id"]), "users": len(user_stats["user_id"]),
+                  "questions": len(question_stats["question_id"]),
+                  **{k: round(v, 3) for k, v in timings.items()}}
+        print(f"Analytics: {result}")
+        return result
+
+    # --- reads for admin commands -----------------------------------------
+
+    def get_overview(self) -> Dict[str, Any]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total_answered), 0), COALESCE(SUM(total_correct), 0),
+                   COALESCE(AVG(current_streak), 0), COALESCE(MAX(longest_streak), 0),
+                   SUM(current_streak > 0), MAX(computed_at)
+            FROM analytics_user_stats
+        """)
+        users, answered, correct, avg_streak, best_streak, streaking, computed_at = cursor.fetchone()
+        conn.close()
+        return {
+            "users": users,
+            "total_answered": answered,
+            "accuracy": round(correct * 100.0 / answered, 2) if answered else 0.0,
+            "avg_current_streak": round(avg_streak, 2),
+            "longest_streak": best_streak,
+            "users_on_streak": streaking or 0,
+            "computed_at": computed_at,
+        }
+
+    def get_hardest_questions(self, limit: int = 5) -> List[Dict[str, Any]]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.question_id, q.track, q.difficulty, s.attempts, s.correct_rate, s.avg_confidence
+            FROM analytics_question_stats s
+            LEFT JOIN questions q ON q.id = s.question_id
+            WHERE s.attempts >= ?
+            ORDER BY s.correct_rate ASC, s.avg_confidence ASC
+            LIMIT ?
+        """, (MIN_ATTEMPTS_FOR_DIFFICULTY, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return [
+            {"question_id": r[0], "track": r[1], "difficulty": r[2], "attempts": r[3],
+             "correct_rate": r[4], "avg_confidence": r[5]}
+            for r in rows
+        ]
+
+    def get_retention(self, cohorts: int = 4, max_offset: int = 4) -> List[Dict[str, Any]]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT cohort_week, week_offset, users, retention
+            FROM analytics_cohort_retention
+            WHERE cohort_week IN (
+                SELECT DISTINCT cohort_week FROM analytics_cohort_retention ORDER BY cohort_week DESC LIMIT ?
+            ) AND week_offset <= ?
+            ORDER BY cohort_week DESC, week_offset ASC
+        """, (cohorts, max_offset))
+        rows = cursor.fetchall()
+        conn.close()
+        return [{"cohort_week": r[0], "week_offset": r[1], "users": r[2], "retention": r[3]} for r in rows]
+
+
+if __name__ == "__main__":
+    AnalyticsService().run_nightly()
@@ -0,0 +1,190 @@
+import sys
+from typing import Dict, Optional
+from db import get_connection
+
+
+def _set_bit(bits: bytearray, index: int):
+    byte = index >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte + 1 - len(bits)))
+    bits[byte] |= 1 << (index & 7)
+
+
+def _has_bit(bits, index: int) -> bool:
+    byte = index >> 3
+    return byte < len(bits) and bool(bits[byte] & (1 << (index & 7)))
+
+
+class AnsweredBitmapStore:
+    """
+    Per-user bitset of answered question ids (bit N set = question N answered).
+    Persisted as a BLOB in user_answer_bitmaps and mirrored in memory as bytearrays,
+    so "next unanswered question in a track" is a byte scan of
+    (track mask & ~answered) instead of a NOT IN subquery over user_questions.
+    50 questions cost 7 bytes per user.
+    """
+
+    def __init__(self):
+        self._bitmaps: Dict[int, bytearray] = {}
+        self._track_masks: Optional[Dict[str, bytearray]] = None
+
+    # --- track masks -------------------------------------------------------
+
+    def reload_masks(self):
+        """Rebuilds the per-track masks from the questions table (call after importing questions)."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, track FROM questions")
+        masks = {}
+        for question_id, track in cursor.fetchall():
+            _set_bit(masks.setdefault(track, bytearray()), question_id)
+        conn.close()
+        self._track_masks = masks
+
+    def _get_mask(self, track: str) -> bytearray:
+        if self._track_masks is None:
+            self.reload_masks()
+        return self._track_masks.get(track, bytearray())
+
+    # --- user bitmaps ------------------------------------------------------
+
+    def _build_from_history(self, cursor, user_id: int) -> bytearray:
+        bits = bytearray()
+        cursor.execute("SELECT question_id FROM user_questions WHERE user_id = ?", (user_id,))
+        for (question_id,) in cursor.fetchall():
+            _set_bit(bits, question_id)
+        return bits
+
+    def _save(self, cursor, user_id: int, bits: bytearray):
+        cursor.execute("""
+            INSERT INTO user_answer_bitmaps (user_id, bitmap) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET bitmap = excluded.bitmap
+        """, (user_id, bytes(bits)))
+
+    def get_bitmap(self, user_id: int) -> bytearray:
+        bits = self._bitmaps.get(user_id)
+        if bits is not None:
+            return bits
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT bitmap FROM user_answer_bitmaps WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            if row:
+                bits = bytearray(row[0])
+            else:
+                # First time we see this user since the bitmap table was introduced
+                bits = self._build_from_history(cursor, user_id)
+                self._save(cursor, user_id, bits)
+                conn.commit()
+        finally:
+            conn.close()
+
+        self._bitmaps[user_id] = bits
+        return bits
+
+    def mark_answered(self, user_id: int, question_id: int, cursor=None):
+        """
+        Sets the answered bit and persists the bitmap.
+        Pass the cursor of the transaction that records the answer to keep both writes atomic.
+        """
+        bits = self.get_bitmap(user_id)
+        _set_bit(bits, question_id)
+        if cursor is not None:
+            self._save(cursor, user_id, bits)
+            return
+
+        conn = get_connection()
+        try:
+            self._save(conn.cursor(), user_id, bits)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def is_answered(self, user_id: int, question_id: int) -> bool:
+        return _has_bit(self.get_bitmap(user_id), question_id)
+
+    def next_unanswered(self, user_id: int, track: str) -> Optional[int]:
+        """Lowest question id in the track whose bit is not set for the user."""
+        mask = self._get_mask(track)
+        answered = self.get_bitmap(user_id)
+        answered_len = len(answered)
+        for i, mask_byte in enumerate(mask):
+            free = mask_byte & ~answered[i] if i < answered_len else mask_byte
+            if free:
+                # Isolate the lowest set bit
+                return (i << 3) + (free & -free).bit_length() - 1
+        return None
+
+    def invalidate(self, user_id: Optional[int] = None):
+        if user_id is None:
+            self._bitmaps.clear()
+        else:
+            self._bitmaps.pop(user_id, None)
+
+    # --- maintenance -------------------------------------------------------
+
+    def rebuild_all(self) -> int:
+        """Recomputes every persisted bitmap from user_questions. Returns the number of users."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        bitmaps = {}
+        cursor.execute("SELECT user_id, question_id FROM user_questions")
+        for user_id, question_id in cursor.fetchall():
+            _set_bit(bitmaps.setdefault(user_id, bytearray()), question_id)
+
+        cursor.execute("DELETE FROM user_answer_bitmaps")
+        cursor.executemany("INSERT INTO user_answer_bitmaps (user_id, bitmap) VALUES (?, ?)",
+                           [(user_id, bytes(bits)) for user_id, bits in bitmaps.items()])
+        conn.commit()
+        conn.close()
+
+        self._bitmaps = bitmaps
+        self.reload_masks()
+        return len(bitmaps)
+
+    def verify(self) -> int:
+        """
+        Checks next_unanswered against the original SQL query for every (user, track) pair.
+        Returns the number of mismatches (printed as they are found).
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT track FROM questions")
+        tracks = [r[0] for r in cursor.fetchall()]
+        cursor.execute("SELECT DISTINCT user_id FROM user_questions UNION SELECT user_id FROM user_answer_bitmaps")
+        user_ids = [r[0] for r in cursor.fetchall()]
+
+        mismatches = 0
+        for user_id in user_ids:
+            for track in tracks:
+                cursor.execute("""
+                    SELECT id FROM questions q
+                    WHERE q.track = ?
+                      AND q.id NOT IN (SELECT question_id FROM user_questions WHERE user_id = ?)
+                    ORDER BY q.id ASC
+                    LIMIT 1
+                """, (track, user_id))
+                row = cursor.fetchone()
+                expected = row[0] if row else None
+                actual = self.next_unanswered(user_id, track)
+                if expected != actual:
+                    mismatches += 1
+                    print(f"MISMATCH user={user_id} track={track}: sql={expected} bitmap={actual}")
+        conn.close()
+        print(f"Verified {len(user_ids)} users x {len(tracks)} tracks: {mismatches} mismatches.")
+        return mismatches
+
+
+if __name__ == "__main__":
+    # python -m services.answered_bitmap [rebuild|verify]
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    store = AnsweredBitmapStore()
+    if command == "rebuild":
+        print(f"Rebuilt answered bitmaps for {store.rebuild_all()} users.")
+    elif command == "verify":
+        sys.exit(1 if store.verify() else 0)
+    else:
+        print("Usage: python -m services.answered_bitmap [rebuild|verify]")
+        sys.exit(2)
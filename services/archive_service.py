@@ -0,0 +1,186 @@
+import argparse
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+from db import current_db_path, get_connection
+from models import UserQuestion
+
+# Optional dependency: zstd compresses short text better and faster when installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+BATCH_SIZE = 1000
+
+# First byte of every archived blob says how it was compressed
+CODEC_ZLIB = b"Z"
+CODEC_ZSTD = b"S"
+
+
+def compress_answer(text: str) -> bytes:
+    data = text.encode("utf-8")
+    if zstandard is not None:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=9).compress(data)
+    return CODEC_ZLIB + zlib.compress(data, 9)
+
+
+def decompress_answer(blob: bytes) -> str:
+    codec, payload = blob[:1], blob[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Archived answer is zstd-compressed but zstandard is not installed.")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return zlib.decompress(payload).decode("utf-8")
+
+
+class ArchiveService:
+    """
+    Tiered storage for answer history. Rows in user_questions stay in place (they drive
+    "already answered", streaks and stats), but answer text older than ARCHIVE_AFTER_DAYS
+    moves into user_answers_archive as a compressed blob and the hot column is set to NULL.
+    Reads go through get_answer/get_history, which fall back to the archive transparently.
+    """
+
+    def archive_older_than(self, days: int = ARCHIVE_AFTER_DAYS, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        archived = raw_bytes = stored_bytes = 0
+        try:
+            while True:
+                cursor.execute("""
+                    SELECT id, user_answer FROM user_questions
+                    WHERE user_answer IS NOT NULL AND answered_at < datetime('now', ?)
+                    LIMIT ?
+                """, (f"-{days} days", batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                blobs = [(row_id, compress_answer(answer)) for row_id, answer in rows]
+                cursor.executemany("""
+                    INSERT INTO user_answers_archive (user_question_id, answer_blob) VALUES (?, ?)
+                    ON CONFLICT(user_question_id) DO UPDATE SET
+                        answer_blob = excluded.answer_blob,
+                        archived_at = CURRENT_TIMESTAMP
+                """, blobs)
+                cursor.executemany("UPDATE user_questions SET user_answer = NULL WHERE id = ?",
+                                   [(row_id,) for row_id, _ in rows])
+                conn.commit()
+
+                archived += len(rows)
+                raw_bytes += sum(len(answer.encode("utf-8")) for _, answer in rows)
+                stored_bytes += sum(len(blob) for _, blob in blobs)
+        finally:
+            conn.close()
+        return {"archived": archived, "raw_bytes": raw_bytes, "stored_bytes": stored_bytes}
+
+    def get_answer(self, user_question_id: int) -> Optional[str]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT uq.user_answer, a.answer_blob
+            FROM user_questions uq
+            LEFT JOIN user_answers_archive a ON a.user_question_id = uq.id
+            WHERE uq.id = ?
+        """, (user_question_id,))
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        return row[0] if row[0] is not None else (decompress_answer(row[1]) if row[1] else None)
+
+    def get_history(self, user_id: int, limit: int = 10) -> List[UserQuestion]:
+        """Most recent answers for a user, with archived answer text read through."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT uq.id, uq.user_id, uq.question_id, uq.answered_correctly, uq.llm_confidence,
+                   uq.user_answer, uq.answered_at, a.answer_blob
+            FROM user_questions uq
+            LEFT JOIN user_answers_archive a ON a.user_question_id = uq.id
+            WHERE uq.user_id = ?
+            ORDER BY uq.answered_at DESC, uq.id DESC
+            LIMIT ?
+        """, (user_id, limit))
+        rows = cursor.fetchall()
+        conn.close()
+
+        history = []
+        for row in rows:
+            row_list = list(row[:7])
+            row_list[3] = bool(row_list[3])
+            if row_list[5] is None and row[7] is not None:
+                row_list[5] = decompress_answer(row[7])
+            history.append(UserQuestion(*row_list))
+        return history
+
+    def compact(self):
+        """Returns freed pages to the filesystem and refreshes planner statistics."""
+        conn = get_connection()
+        try:
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+
+    def storage_report(self) -> Dict[str, Any]:
+        """DB file size plus timings of the hot queries that scan user_questions."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA freelist_count")
+        free_pages = cursor.fetchone()[0]
+
+        timings = {}
+        for label, sql in (
+            ("full_scan_ms", "SELECT COUNT(*), SUM(answered_correctly) FROM user_questions"),
+            ("streak_dates_ms", "SELECT DISTINCT user_id, date(answered_at) FROM user_questions"),
+        ):
+            started = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            timings[label] = round((time.perf_counter() - started) * 1000, 2)
+        conn.close()
+
+        report = {
+            "db_bytes": page_count * page_size,
+            "free_bytes": free_pages * page_size,
+        }
+        db_path = current_db_path()
+        if os.path.exists(db_path):
+            report["file_bytes"] = os.path.getsize(db_path)
+        report.update(timings)
+        return report
+
+    def run_maintenance(self, days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, Any]:
+        """Archive + VACUUM, with storage reports before and after. Used by the scheduler job."""
+        before = self.storage_report()
+        result = self.archive_older_than(days)
+        self.compact()
+        after = self.storage_report()
+        print(f"Archive maintenance: moved {result['archived']} answers "
+              f"({result['raw_bytes']} -> {result['stored_bytes']} bytes), "
+              f"DB {before['db_bytes']} -> {after['db_bytes']} bytes, "
+              f"full scan {before['full_scan_ms']} -> {after['full_scan_ms']} ms")
+        return {"before": before, "after": after, **result}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old answer text and compact the database.")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--report-only", action="store_true")
+    args = parser.parse_args()
+
+    service = ArchiveService()
+    if args.report_only:
+        print(service.storage_report())
+    else:
+        outcome = service.run_maintenance(args.days)
+        print(f"before: {outcome['before']}")
+        print(f"after:  {outcome['after']}")
@@ -0,0 +1,83 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class KeyedLocks:
+    """
+    One asyncio.Lock per key (e.g. per user), so work for the same key runs one at a time
+    while different keys proceed concurrently. Locks are dropped once nobody holds or waits on them.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, list] = {}  # key -> [lock, users]
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the coroutine,
+    later callers await the same result instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced_count = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced_count += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an un-awaited failure doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+
+class RecentIds:
+    """Bounded set of recently seen ids (e.g. Telegram update_id) for idempotent handling."""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._seen = OrderedDict()
+
+    def check_and_add(self, item: Hashable) -> bool:
+        """Returns True if the id was already seen; otherwise records it and returns False."""
+        if item in self._seen:
+            return True
+        self._seen[item] = None
+        if len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+        return False
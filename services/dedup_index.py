@@ -0,0 +1,210 @@
+"""
+MinHash/LSH index for near-duplicate question text.
+
+Each text becomes a set of word 3-gram shingles (over normalize_question_text), summarized by a
+64-value MinHash signature. Signatures are cut into 16 bands of 4 values; texts sharing any band
+land in the same bucket and become candidates, so a lookup touches a few buckets instead of
+every question. Candidates are confirmed with the exact Jaccard similarity of their shingles.
+With 16x4 bands, pairs above ~0.5 similarity are found with high probability.
+
+    python -m services.dedup_index report [--threshold 0.8] [--file data/questions.json]
+"""
+import argparse
+import os
+import zlib
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from db import get_connection
+from question_bank import iter_questions, normalize_question_text
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+BATCH_SIZE = 2000
+DUPLICATE_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20240501)  # Fixed seed: signatures are comparable across runs
+_A = _rng.randint(1, (1 << 31) - 1, NUM_PERM).astype(np.uint64)[:, None]
+_B = _rng.randint(0, (1 << 31) - 1, NUM_PERM).astype(np.uint64)[:, None]
+# Odd multipliers folding each band's ROWS values into one 64-bit bucket key (wrapping arithmetic)
+_BAND_MIX = (_rng.randint(1, 1 << 31, ROWS).astype(np.uint64) << np.uint64(32)) | np.uint64(1)
+_EMPTY = np.empty(0, dtype=np.uint64)
+
+
+def shingles(text: Optional[str]) -> np.ndarray:
+    """Sorted unique hashes of the word 3-grams of the normalized text (the whole text if shorter)."""
+    words = normalize_question_text(text).split()
+    if not words:
+        return _EMPTY
+    if len(words) <= SHINGLE_SIZE:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    return np.unique(hashes)
+
+
+def signatures(shingle_sets: Sequence[np.ndarray]) -> np.ndarray:
+    """MinHash signatures, shape (len(shingle_sets), NUM_PERM), computed for the whole batch at once."""
+    result = np.full((len(shingle_sets), NUM_PERM), _PRIME, dtype=np.uint64)
+    nonempty = [i for i, s in enumerate(shingle_sets) if len(s)]
+    if not nonempty:
+        return result
+    sets = [shingle_sets[i] for i in nonempty]
+    flat = np.concatenate(sets) % _PRIME
+    hashed = (_A * flat + _B) % _PRIME  # (NUM_PERM, total shingles)
+    offsets = np.cumsum([0] + [len(s) for s in sets[:-1]])
+    result[nonempty] = np.minimum.reduceat(hashed, offsets, axis=1).T
+    return result
+
+
+def band_keys(signature_matrix: np.ndarray) -> List[List[int]]:
+    """One int bucket key per band for each signature row."""
+    bands = signature_matrix.reshape(len(signature_matrix), BANDS, ROWS)
+    with np.errstate(over="ignore"):
+        return (bands * _BAND_MIX).sum(axis=2, dtype=np.uint64).tolist()
+
+
+def fingerprints(texts: Sequence[str]) -> List[Tuple[np.ndarray, List[int]]]:
+    """(shingles, band keys) per text; the unit MinHashIndex stores and matches on."""
+    sets = [shingles(text) for text in texts]
+    return list(zip(sets, band_keys(signatures(sets))))
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    if not len(a) or not len(b):
+        return 0.0
+    common = np.intersect1d(a, b, assume_unique=True).size
+    return common / (len(a) + len(b) - common)
+
+
+class MinHashIndex:
+    """Near-duplicate lookup over (item_id, text) pairs."""
+
+    def __init__(self):
+        self._shingles: Dict[Hashable, np.ndarray] = {}
+        self._buckets: List[Dict[int, List[Hashable]]] = [{} for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self._shingles)
+
+    def __contains__(self, item_id):
+        return item_id in self._shingles
+
+    def add(self, item_id: Hashable, text: str):
+        self.add_many([(item_id, text)])
+
+    def add_many(self, items: Iterable[Tuple[Hashable, str]]):
+        items = list(items)
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            for (item_id, _), fingerprint in zip(batch, fingerprints([text for _, text in batch])):
+                self.add_fingerprint(item_id, fingerprint)
+
+    def add_fingerprint(self, item_id: Hashable, fingerprint: Tuple[np.ndarray, List[int]]):
+        """Adds an item whose fingerprint was already computed (e.g. to match it first)."""
+        shingle_set, keys = fingerprint
+        if not len(shingle_set) or item_id in self._shingles:
+            return
+        self._shingles[item_id] = shingle_set
+        for buckets, key in zip(self._buckets, keys):
+            buckets.setdefault(key, []).append(item_id)
+
+    def candidates(self, keys: List[int]) -> set:
+        found = set()
+        for buckets, key in zip(self._buckets, keys):
+            found.update(buckets.get(key, ()))
+        return found
+
+    def match(self, fingerprint: Tuple[np.ndarray, List[int]],
+              threshold: float = DUPLICATE_THRESHOLD) -> List[Tuple[Hashable, float]]:
+        """Indexed items with Jaccard similarity >= threshold, most similar first."""
+        shingle_set, keys = fingerprint
+        if not len(shingle_set):
+            return []
+        matches = []
+        for item_id in self.candidates(keys):
+            similarity = jaccard(shingle_set, self._shingles[item_id])
+            if similarity >= threshold:
+                matches.append((item_id, similarity))
+        matches.sort(key=lambda m: -m[1])
+        return matches
+
+    def query(self, text: str, threshold: float = DUPLICATE_THRESHOLD) -> List[Tuple[Hashable, float]]:
+        return self.match(fingerprints([text])[0], threshold)
+
+    def clusters(self, threshold: float = DUPLICATE_THRESHOLD) -> List[List[Hashable]]:
+        """Groups of items connected by pairwise similarity >= threshold (only groups of 2+)."""
+        parent: Dict[Hashable, Hashable] = {}
+
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        checked = set()
+        for buckets in self._buckets:
+            for members in buckets.values():
+                for i, a in enumerate(members):
+                    for b in members[i + 1:]:
+                        if (a, b) in checked:
+                            continue
+                        checked.add((a, b))
+                        if jaccard(self._shingles[a], self._shingles[b]) >= threshold:
+                            root_a, root_b = find(a), find(b)
+                            if root_a != root_b:
+                                parent[root_b] = root_a
+
+        groups: Dict[Hashable, List[Hashable]] = {}
+        for item_id in parent:
+            groups.setdefault(find(item_id), []).append(item_id)
+        return [sorted(group, key=str) for group in groups.values() if len(group) > 1]
+
+
+def _load_rows(path: Optional[str]) -> List[Dict[str, Any]]:
+    if path:
+        return [{"id": i + 1, **q} for i, q in enumerate(iter_questions(path))]
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, track, question_text FROM questions ORDER BY id")
+    rows = [{"id": r[0], "track": r[1], "question_text": r[2]} for r in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def report(threshold: float = DUPLICATE_THRESHOLD, path: Optional[str] = None):
+    """Prints near-duplicate clusters per track, from the DB or from a question file."""
+    rows = _load_rows(path)
+    by_id = {row["id"]: row for row in rows}
+    indexes: Dict[str, MinHashIndex] = {}
+    for row in rows:
+        indexes.setdefault(row["track"], MinHashIndex())
+    for track, index in indexes.items():
+        index.add_many((row["id"], row["question_text"]) for row in rows if row["track"] == track)
+
+    source = path or "database"
+    total = 0
+    for track, index in sorted(indexes.items()):
+        for group in index.clusters(threshold):
+            total += 1
+            print(f"[{track}] cluster of {len(group)}:")
+            for item_id in group:
+                text = " ".join(by_id[item_id]["question_text"].split())
+                print(f"  #{item_id}: {text[:100]}")
+    print(f"{total} near-duplicate clusters among {len(rows)} questions in {source} "
+          f"(similarity >= {threshold}).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate report for the question bank.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--file", help="Check a questions JSON/JSONL file instead of the database "
+                                       "(ids are 1-based positions in the file)")
+    args = parser.parse_args()
+    report(args.threshold, args.file)
@@ -0,0 +1,155 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+from db import get_connection
+
+
+class Leaderboard:
+    """
+    In-memory ranking of users by number of correctly answered questions.
+
+    Users are grouped into per-score buckets, and a Fenwick tree over score values counts how many
+    users hold each score, so "how many users score higher than me" is a prefix sum:
+    rank lookups and score updates are O(log S) (S = highest score), top-K walks the
+    non-empty scores from the top. Ties share a rank; within a score, whoever got there first
+    is listed first. Built from SQLite at startup and updated incrementally by record_answer.
+    """
+
+    def __init__(self):
+        self._reset()
+        self.loaded = False
+
+    def _reset(self):
+        self._scores: Dict[int, int] = {}          # user_id -> score
+        self._buckets: Dict[int, Dict[int, None]] = {}  # score -> ordered set of user_ids
+        self._distinct: List[int] = []             # sorted non-empty scores
+        self._tree = [0] * 65                      # Fenwick tree, 1-based over scores 1..capacity
+        self._capacity = 64
+
+    # --- Fenwick tree --------------------------------------------------------
+
+    def _tree_add(self, score: int, delta: int):
+        i = score
+        while i <= self._capacity:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _tree_prefix(self, score: int) -> int:
+        """Number of users with 1 <= score' <= score."""
+        total = 0
+        i = min(score, self._capacity)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _grow(self):
+        self._capacity *= 2
+        self._tree = [0] * (self._capacity + 1)
+        for score in self._distinct:
+            count = len(self._buckets[score])
+            i = score
+            while i <= self._capacity:
+                self._tree[i] += count
+                i += i & -i
+
+    # --- updates -------------------------------------------------------------
+
+    def _move(self, user_id: int, old: int, new: int):
+        if old > 0:
+            bucket = self._buckets[old]
+            del bucket[user_id]
+            if not bucket:
+                del self._buckets[old]
+                del self._distinct[bisect.bisect_left(self._distinct, old)]
+            self._tree_add(old, -1)
+        if new > 0:
+            while new > self._capacity:
+                self._grow()
+            bucket = self._buckets.get(new)
+            if bucket is None:
+                bucket = self._buckets[new] = {}
+                bisect.insort(self._distinct, new)
+            bucket[user_id] = None
+            self._tree_add(new, 1)
+            self._scores[user_id] = new
+        else:
+            self._scores.pop(user_id, None)
+
+    def add(self, user_id: int, delta: int = 1):
+        """Adjusts a user's score, e.g. +1 when a question is newly answered correctly."""
+        if not self.loaded:
+            return  # The next rebuild reads the committed answer from SQLite
+        old = self._scores.get(user_id, 0)
+        new = max(old + delta, 0)
+        if new != old:
+            self._move(user_id, old, new)
+
+    def rebuild(self):
+        """Reloads all scores from user_questions."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, COUNT(*) FROM user_questions
+            WHERE answered_correctly = 1
+            GROUP BY user_id
+            ORDER BY MIN(answered_at)
+        """)
+        rows = cursor.fetchall()
+        conn.close()
+        self.load(rows)
+
+    def load(self, rows):
+        """Replaces the board with (user_id, score) pairs."""
+        self._reset()
+        for user_id, score in rows:
+            if score > 0:
+                self._scores[user_id] = score
+                self._buckets.setdefault(score, {})[user_id] = None
+        self._distinct = sorted(self._buckets)
+        while self._distinct and self._distinct[-1] > self._capacity:
+            self._capacity *= 2
+        self._tree = [0] * (self._capacity + 1)
+        # O(S) Fenwick construction: add each node into its parent
+        for score in self._distinct:
+            self._tree[score] = len(self._buckets[score])
+        for i in range(1, self._capacity + 1):
+            parent = i + (i & -i)
+            if parent <= self._capacity:
+                self._tree[parent] += self._tree[i]
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.rebuild()
+
+    # --- queries -------------------------------------------------------------
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._scores)
+
+    def score(self, user_id: int) -> int:
+        self._ensure_loaded()
+        return self._scores.get(user_id, 0)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based competition rank, or None if the user has no correct answers yet."""
+        self._ensure_loaded()
+        score = self._scores.get(user_id)
+        if not score:
+            return None
+        return 1 + len(self._scores) - self._tree_prefix(score)
+
+    def top(self, k: int = 10) -> List[Tuple[int, int, int]]:
+        """Top k as (rank, user_id, score)."""
+        self._ensure_loaded()
+        result = []
+        higher = 0
+        for score in reversed(self._distinct):
+            bucket = self._buckets[score]
+            for user_id in bucket:
+                if len(result) == k:
+                    return result
+                result.append((higher + 1, user_id, score))
+            higher += len(bucket)
+        return result
@@ -0,0 +1,282 @@
+import heapq
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from db import get_connection
+from services.answered_bitmap import AnsweredBitmapStore
+from services.cache import LRUTTLCache
+
+DIFFICULTY_LEVELS = {"easy": 0, "medium": 1, "hard": 2}
+MAX_LEVEL = 2
+PROMOTE_AFTER = 3          # confident correct answers in a row to move up a level
+DEMOTE_AFTER = 2           # missed questions in a row to move down a level
+LOW_CONFIDENCE = 0.6       # correct answers below this are re-asked like misses
+REASK_INTERVALS = (1 * 86400, 3 * 86400, 7 * 86400)  # spacing of successive re-asks
+# Queues kept in memory; an evicted queue is reloaded from user_question_queues on next use
+QUEUE_CACHE_SIZE = int(os.getenv("QUEUE_CACHE_SIZE", "4096"))
+QUEUE_CACHE_TTL = float(os.getenv("QUEUE_CACHE_TTL", "3600"))
+
+# Persisted state: header, then (question_id, due, step) per re-ask, then missed question ids,
+# then the pending (last sent, unanswered) question id or 0; states saved without it still load
+_HEADER = struct.Struct("<BBBHH")   # level, streak, misses in a row, #re-asks, #missed
+_REASK = struct.Struct("<IIB")
+_MISSED = struct.Struct("<I")
+_PENDING = struct.Struct("<I")
+
+
+class _TrackQueue:
+    """Queue state for one (user, track)."""
+    __slots__ = ("level", "streak", "misses", "cursors", "reasks", "reask_heap", "missed", "pending")
+
+    def __init__(self):
+        self.level = 0
+        self.streak = 0
+        self.misses = 0
+        self.cursors = [0] * (MAX_LEVEL + 1)               # per difficulty: answered prefix of its id list
+        self.reasks: Dict[int, Tuple[int, int]] = {}       # qid -> (due, step)
+        self.reask_heap: List[Tuple[int, int]] = []        # heap of (due, qid); stale entries skipped
+        self.missed: Set[int] = set()                      # wrong attempts since the last correct answer
+        self.pending: Optional[int] = None                 # last question sent and not answered yet
+
+    def pack(self) -> bytes:
+        parts = [_HEADER.pack(self.level, self.streak, self.misses, len(self.reasks), len(self.missed))]
+        parts.extend(_REASK.pack(qid, due, step) for qid, (due, step) in self.reasks.items())
+        parts.extend(_MISSED.pack(qid) for qid in self.missed)
+        parts.append(_PENDING.pack(self.pending or 0))
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> "_TrackQueue":
+        queue = cls()
+        queue.level, queue.streak, queue.misses, n_reasks, n_missed = _HEADER.unpack_from(blob, 0)
+        offset = _HEADER.size
+        for _ in range(n_reasks):
+            qid, due, step = _REASK.unpack_from(blob, offset)
+            offset += _REASK.size
+            queue.reasks[qid] = (due, step)
+            queue.reask_heap.append((due, qid))
+        heapq.heapify(queue.reask_heap)
+        for _ in range(n_missed):
+            queue.missed.add(_MISSED.unpack_from(blob, offset)[0])
+            offset += _MISSED.size
+        if len(blob) >= offset + _PENDING.size:
+            queue.pending = _PENDING.unpack_from(blob, offset)[0] or None
+        return queue
+
+
+class QuestionQueueStore:
+    """
+    Per-user, per-track question queues that decide what to ask next.
+
+    Questions never answered are taken by how far their difficulty is from the user's current
+    level (then by difficulty and id): each (user, track) walks the track's id list per
+    difficulty with a cursor that only skips answered ids. Answered questions scheduled to be
+    asked again sit in a heap ordered by due time; a re-ask that is due comes first. Missed questions
+    (wrong attempts before the correct answer, or a low-confidence answer) are re-asked after
+    1, 3 and 7 days, each confident answer moving them one step further until they graduate.
+    Confident answers in a row raise the level, misses in a row lower it.
+
+    peek() is what get_next_question_for_user returns; mark_sent() records what was actually
+    sent, which stays pending() until answered; record_answer()/record_miss() update the
+    queue in O(log n). Only levels, re-asks, pending misses and the pending question are
+    persisted (a few bytes per user and track, in user_question_queues); unanswered questions
+    come from the answered bitmap.
+    Loaded queues live in a bounded LRU/TTL cache, so memory stays flat as users come and go.
+    """
+
+    def __init__(self, answered: AnsweredBitmapStore):
+        self.answered = answered
+        self._queues = LRUTTLCache(maxsize=QUEUE_CACHE_SIZE, ttl=QUEUE_CACHE_TTL)
+        self._questions: Optional[Dict[int, Tuple[str, int]]] = None  # qid -> (track, difficulty level)
+        self._track_ids: Dict[str, List[List[int]]] = {}              # track -> ids per difficulty level
+
+    # --- catalog -----------------------------------------------------------
+
+    def reload_questions(self):
+        """Reloads question tracks/difficulties (call after importing questions)."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, track, difficulty FROM questions ORDER BY id")
+        questions = {}
+        track_ids = {}
+        for question_id, track, difficulty in cursor.fetchall():
+            level = DIFFICULTY_LEVELS.get((difficulty or "").lower(), 1)
+            questions[question_id] = (track, level)
+            track_ids.setdefault(track, [[] for _ in range(MAX_LEVEL + 1)])[level].append(question_id)
+        conn.close()
+        self._questions, self._track_ids = questions, track_ids
+        self._queues.clear()
+
+    def _question(self, question_id: int) -> Optional[Tuple[str, int]]:
+        if self._questions is None:
+            self.reload_questions()
+        return self._questions.get(question_id)
+
+    def track_of(self, question_id: int) -> Optional[str]:
+        question = self._question(question_id)
+        return question[0] if question else None
+
+    # --- loading / saving ----------------------------------------------------
+
+    def get(self, user_id: int, track: str) -> _TrackQueue:
+        queue = self._queues.get((user_id, track))
+        if queue is not None:
+            return queue
+        if self._questions is None:
+            self.reload_questions()
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT state FROM user_question_queues WHERE user_id = ? AND track = ?", (user_id, track))
+        row = cursor.fetchone()
+        conn.close()
+        queue = _TrackQueue.unpack(row[0]) if row else _TrackQueue()
+        self._queues.set((user_id, track), queue)
+        return queue
+
+    def _save(self, cursor, user_id: int, track: str, queue: _TrackQueue):
+        cursor.execute("""
+            INSERT INTO user_question_queues (user_id, track, state) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, track) DO UPDATE SET state = excluded.state
+        """, (user_id, track, queue.pack()))
+
+    def _persist(self, user_id: int, track: str, queue: _TrackQueue, cursor=None):
+        if cursor is not None:
+            self._save(cursor, user_id, track, queue)
+            return
+        conn = get_connection()
+        try:
+            self._save(conn.cursor(), user_id, track, queue)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def invalidate(self, user_id: Optional[int] = None):
+        if user_id is None:
+            self._queues.clear()
+        else:
+            for track in self._track_ids:
+                self._queues.invalidate((user_id, track))
+
+    # --- queries -------------------------------------------------------------
+
+    def _due_reask(self, queue: _TrackQueue, now: float) -> Optional[int]:
+        heap = queue.reask_heap
+        while heap:
+            due, question_id = heap[0]
+            if queue.reasks.get(question_id, (None,))[0] != due:
+                heapq.heappop(heap)  # Rescheduled or graduated since it was pushed
+                continue
+            return question_id if due <= now else None
+        return None
+
+    def peek(self, user_id: int, track: str, now: Optional[float] = None) -> Optional[int]:
+        """The question to ask next in the track, or None if nothing is due."""
+        queue = self.get(user_id, track)
+        question_id = self._due_reask(queue, time.time() if now is None else now)
+        if question_id is not None:
+            return question_id
+        ids_by_level = self._track_ids.get(track)
+        if not ids_by_level:
+            return None
+        for difficulty in sorted(range(MAX_LEVEL + 1), key=lambda d: (abs(d - queue.level), d)):
+            ids = ids_by_level[difficulty]
+            i = queue.cursors[difficulty]
+            # Skips answered ids, including ones answered out of order (e.g. by replying to an older message)
+            while i < len(ids) and self.answered.is_answered(user_id, ids[i]):
+                i += 1
+            queue.cursors[difficulty] = i
+            if i < len(ids):
+                return ids[i]
+        return None
+
+    def pending(self, user_id: int, track: str) -> Optional[int]:
+        """
+        The question last sent in the track and not answered since, i.e. the one a plain
+        (non-reply) answer is for. Level changes and re-asks falling due only change what
+        peek() sends next, never this.
+        """
+        question_id = self.get(user_id, track).pending
+        return question_id if question_id is not None and self._question(question_id) else None
+
+    def is_reask_due(self, user_id: int, question_id: int, now: Optional[float] = None) -> bool:
+        question = self._question(question_id)
+        if question is None:
+            return False
+        entry = self.get(user_id, question[0]).reasks.get(question_id)
+        return entry is not None and entry[0] <= (time.time() if now is None else now)
+
+    # --- updates -------------------------------------------------------------
+
+    def _schedule(self, queue: _TrackQueue, question_id: int, step: int, now: float):
+        if step >= len(REASK_INTERVALS):
+            queue.reasks.pop(question_id, None)  # Graduated
+            return
+        due = int(now) + REASK_INTERVALS[step]
+        queue.reasks[question_id] = (due, step)
+        heapq.heappush(queue.reask_heap, (due, question_id))
+
+    def mark_sent(self, user_id: int, question_id: int):
+        """Makes a question that was just sent the pending one of its track."""
+        question = self._question(question_id)
+        if question is None:
+            return
+        queue = self.get(user_id, question[0])
+        if queue.pending != question_id:
+            queue.pending = question_id
+            self._persist(user_id, question[0], queue)
+
+    def record_miss(self, user_id: int, question_id: int):
+        """A wrong attempt: the question stays pending and is re-asked once answered."""
+        question = self._question(question_id)
+        if question is None:
+            return
+        track = question[0]
+        queue = self.get(user_id, track)
+        if question_id in queue.missed:
+            return
+        queue.missed.add(question_id)
+        queue.streak = 0
+        queue.misses += 1
+        if queue.misses >= DEMOTE_AFTER:
+            queue.misses = 0
+            queue.level = max(queue.level - 1, 0)
+        self._persist(user_id, track, queue)
+
+    def record_answer(self, user_id: int, question_id: int, is_correct: bool, confidence: float,
+                      cursor=None, now: Optional[float] = None):
+        """
+        Updates the queue after an answer was recorded (and marked in the answered bitmap).
+        Pass the cursor of the transaction that records the answer to keep the writes atomic.
+        """
+        question = self._question(question_id)
+        if question is None:
+            return
+        track = question[0]
+        now = time.time() if now is None else now
+        queue = self.get(user_id, track)
+
+        missed = not is_correct or confidence < LOW_CONFIDENCE or question_id in queue.missed
+        queue.missed.discard(question_id)
+        if queue.pending == question_id:
+            queue.pending = None
+        previous = queue.reasks.get(question_id)
+        if missed:
+            self._schedule(queue, question_id, 0, now)
+            queue.streak = 0
+            if not is_correct:
+                queue.misses += 1
+                if queue.misses >= DEMOTE_AFTER:
+                    queue.misses = 0
+                    queue.level = max(queue.level - 1, 0)
+        else:
+            if previous is not None:
+                self._schedule(queue, question_id, previous[1] + 1, now)
+            queue.misses = 0
+            queue.streak += 1
+            if queue.streak >= PROMOTE_AFTER:
+                queue.streak = 0
+                queue.level = min(queue.level + 1, MAX_LEVEL)
+        # The answered question is skipped lazily in peek()
+        self._persist(user_id, track, queue, cursor=cursor)
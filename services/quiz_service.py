@@ -1,40 +1,126 @@
+import contextvars
 import json
 import os
-import re
+import threading
 from typing import Optional
 from db import get_connection
 from models import Question
+from question_bank import normalize_question_text
+from services.answered_bitmap import AnsweredBitmapStore
+from services.leaderboard import Leaderboard
+from services.question_queue import QuestionQueueStore
+
+# Candidate cut-off when matching a replied-to message against the question index
+REPLY_MATCH_THRESHOLD = 0.5
+
+class QuestionCatalog:
+    """
+    Formatted question texts from questions.json, keyed by normalized text, used to swap the
+    nicely formatted version in for DB text. Independent of any user data, so one instance
+    can be shared by several QuizService instances (e.g. one per tenant, see tenancy.py).
+    """
 
-class QuizService:
     def __init__(self):
-        # Load formatted questions into memory for runtime text swapping
-        self.format_map = {}
-        try:
-            # Use Current Working Directory (Project Root) + data/questions.json
-            # This is safer for Railway/Docker environments where main.py runs from root
-            json_path = os.path.join(os.getcwd(), 'data', 'questions.json')
-            
-            if os.path.exists(json_path):
-                with open(json_path, 'r') as f:
-                    data = json.load(f)
-                    for q in data:
-                        # Key: Normalized text (no backticks, lower, collapsed spaces)
-                        # Value: The beautifully formatted text from JSON
-                        norm_key = self._normalize(q['question_text'])
-                        self.format_map[norm_key] = q['question_text']
-                print(f"SUCCESS: Loaded {len(self.format_map)} formatted questions for text swapping.")
-            else:
-                print(f"WARNING: questions.json not found at {json_path}")
+        # Loaded on first use (or in the background via QuizService.warm_catalog) instead of at import time
+        self._format_map = None
+        self._lock = threading.Lock()
+
+    @property
+    def format_map(self):
+        if self._format_map is None:
+            self.load()
+        return self._format_map
+
+    def load(self):
+        with self._lock:
+            if self._format_map is not None:
+                return
+            format_map = {}
+            try:
+                # Use Current Working Directory (Project Root) + data/questions.json
+                # This is safer for Railway/Docker environments where main.py runs from root
+                json_path = os.path.join(os.getcwd(), 'data', 'questions.json')
+                if not os.path.exists(json_path):
+                    json_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'questions.json')
                 
-        except Exception as e:
-            print(f"Warning: Could not load questions.json for formatting: {e}")
+                if os.path.exists(json_path):
+                    with open(json_path, 'r') as f:
+                        data = json.load(f)
+                        for q in data:
+                            # Key: Normalized text (no backticks, lower, collapsed spaces)
+                            # Value: The beautifully formatted text from JSON
+                            norm_key = normalize_question_text(q['question_text'])
+                            format_map[norm_key] = q['question_text']
+                    print(f"SUCCESS: Loaded {len(format_map)} formatted questions for text swapping.")
+                else:
+                    print(f"WARNING: questions.json not found at {json_path}")
+                    
+            except Exception as e:
+                print(f"Warning: Could not load questions.json for formatting: {e}")
+            self._format_map = format_map
+
+
+class QuizService:
+    def __init__(self, catalog: Optional[QuestionCatalog] = None):
+        self.catalog = catalog or QuestionCatalog()
+        self._question_texts = None  # question id -> normalized text
+        self._question_ids = None    # normalized text -> question id
+        self._question_index = None
+        self._catalog_lock = threading.Lock()
+        self.answered = AnsweredBitmapStore()
+        self.queues = QuestionQueueStore(self.answered)
+        self.leaderboard = Leaderboard()
+
+    @property
+    def format_map(self):
+        return self.catalog.format_map
+
+    @property
+    def question_index(self) -> "MinHashIndex":
+        if self._question_index is None:
+            self.load_question_index()
+        return self._question_index
+
+    def warm_catalog(self) -> threading.Thread:
+        """Loads the catalog and question index on a background thread so startup doesn't wait on them."""
+        def load():
+            self.catalog.load()
+            self.load_question_index()
+        # Run in a copy of the caller's context so the thread reads the same database (see db.use_database)
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(load,),
+                                  name="catalog-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def load_catalog(self):
+        self.catalog.load()
+
+    def load_question_index(self):
+        """Indexes the questions table for reply matching (exact normalized text + MinHash/LSH)."""
+        # Imported here: dedup_index pulls in numpy, which would slow down importing the bot
+        from services.dedup_index import MinHashIndex
+
+        with self._catalog_lock:
+            if self._question_index is not None:
+                return
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, question_text FROM questions ORDER BY id")
+            rows = cursor.fetchall()
+            conn.close()
+
+            texts = {question_id: self._normalize(text) for question_id, text in rows}
+            ids = {}
+            for question_id, norm in texts.items():
+                ids.setdefault(norm, question_id)
+            index = MinHashIndex()
+            index.add_many(texts.items())
+            self._question_texts, self._question_ids = texts, ids
+            self._question_index = index
 
     def _normalize(self, text):
         """Standardizes text for matching: lower case, no backticks, single spaces."""
-        if not text: return ""
-        text = text.replace('`', '')
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text.lower()
+        return normalize_question_text(text)
 
     def _apply_formatting(self, question: Question) -> Question:
         """Swaps the DB text with the formatted JSON text if a match is found."""
@@ -42,34 +128,35 @@ class QuizService:
         
         # Try to find a better formatted version of the question text
         key = self._normalize(question.question_text)
+        # Exact normalized match only: near-identical texts can be different questions
         if key in self.format_map:
             question.question_text = self.format_map[key]
             
         return question
 
     def get_next_question_for_user(self, user_id: int, track: str) -> Optional[Question]:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Select a question that has NOT been answered by this user
-        query = """
-        SELECT id, track, difficulty, question_text, canonical_answer, explanation
-        FROM questions q
-        WHERE q.track = ?
-          AND q.id NOT IN (
-              SELECT question_id FROM user_questions WHERE user_id = ?
-          )
-        ORDER BY q.id ASC
-        LIMIT 1
+        # Head of the user's adaptive queue: a due re-ask, else the unanswered question
+        # closest to their level (see QuestionQueueStore)
+        question_id = self.queues.peek(user_id, track)
+        if question_id is None:
+            return None
+        return self.get_question_by_id(question_id)
+
+    def get_pending_question_for_user(self, user_id: int, track: str) -> Optional[Question]:
         """
-        
-        cursor.execute(query, (track, user_id))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return self._apply_formatting(Question(*row))
-        return None
+        The question a plain answer in the track is graded against: the one last sent and not
+        answered yet, else (nothing sent since the last answer) the next one in the queue.
+        """
+        question_id = self.queues.pending(user_id, track)
+        if question_id is None:
+            question_id = self.queues.peek(user_id, track)
+        if question_id is None:
+            return None
+        return self.get_question_by_id(question_id)
+
+    def mark_question_sent(self, user_id: int, question_id: int):
+        """Records that a question was sent, making it the user's pending one in its track."""
+        self.queues.mark_sent(user_id, question_id)
 
     def get_question_by_id(self, question_id: int) -> Optional[Question]:
         conn = get_connection()
@@ -83,46 +170,82 @@ class QuizService:
         return None
 
     def record_answer(self, user_id: int, question_id: int, user_answer: str, is_correct: bool, confidence: float):
+        # Load the bitmap and queue before opening the write transaction (a first load may persist)
+        self.answered.get_bitmap(user_id)
+        track = self.queues.track_of(question_id)
+        if track is not None:
+            self.queues.get(user_id, track)
         conn = get_connection()
         cursor = conn.cursor()
         try:
+            cursor.execute("SELECT answered_correctly FROM user_questions WHERE user_id = ? AND question_id = ?",
+                           (user_id, question_id))
+            previous = cursor.fetchone()
+            was_correct = bool(previous[0]) if previous else False
+
+            # Upsert on the (user_id, question_id) unique index: a duplicate or
+            # re-evaluated answer updates the existing row instead of adding another
             cursor.execute("""
             INSERT INTO user_questions (user_id, question_id, answered_correctly, llm_confidence, user_answer)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, question_id) DO UPDATE SET
+                answered_correctly = excluded.answered_correctly,
+                llm_confidence = excluded.llm_confidence,
+                user_answer = excluded.user_answer
             """, (user_id, question_id, is_correct, confidence, user_answer))
+            self.answered.mark_answered(user_id, question_id, cursor=cursor)
+            self.queues.record_answer(user_id, question_id, is_correct, confidence, cursor=cursor)
             conn.commit()
         finally:
             conn.close()
+
+        # Score = number of correctly answered questions
+        delta = int(bool(is_correct)) - int(was_correct)
+        if delta:
+            self.leaderboard.add(user_id, delta)
     
     def is_question_answered_by_user(self, user_id: int, question_id: int) -> bool:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM user_questions WHERE user_id = ? AND question_id = ?", (user_id, question_id))
-        row = cursor.fetchone()
-        conn.close()
-        return row is not None
+        return self.answered.is_answered(user_id, question_id)
+
+    def is_question_due_for_reask(self, user_id: int, question_id: int) -> bool:
+        return self.queues.is_reask_due(user_id, question_id)
+
+    def record_miss(self, user_id: int, question_id: int):
+        """Notes a wrong attempt so the question is re-asked later and the level adapts."""
+        self.queues.record_miss(user_id, question_id)
 
     def get_question_from_message_text(self, message_text: str) -> Optional[Question]:
         """
-        Identifies a question if the question_text is a substring of the message_text.
-        Useful for determining which question a user is replying to.
-        Uses normalization to handle Markdown formatting differences.
+        Identifies the question a message contains (e.g. the quiz message a user replied to).
+        Tries the exact normalized question text first, then near-duplicate candidates from the
+        MinHash/LSH index: a candidate matches if its text is contained in the message, or is
+        near-identical (the question was reworded after the message was sent).
+        Falls back to scanning every question for a contained text.
         """
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, track, difficulty, question_text, canonical_answer, explanation FROM questions")
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # We need to normalize the message text the same way
+        from services.dedup_index import DUPLICATE_THRESHOLD
+
+        self.question_index  # Loaded on first use
         norm_message = self._normalize(message_text)
-        
-        for row in rows:
-            q = Question(*row)
-            # Normalize the DB question text
-            norm_question = self._normalize(q.question_text)
-            
-            # Check if normalized question text is in normalized message text
-            if norm_question in norm_message:
-                return self._apply_formatting(q)
-        return None
+        body = _question_body(message_text)
+
+        question_id = self._question_ids.get(self._normalize(body))
+        if question_id is None:
+            for candidate_id, similarity in self._question_index.query(body, REPLY_MATCH_THRESHOLD):
+                if similarity >= DUPLICATE_THRESHOLD or self._question_texts[candidate_id] in norm_message:
+                    question_id = candidate_id
+                    break
+        if question_id is None:
+            question_id = next((qid for qid, norm_question in self._question_texts.items()
+                                if norm_question and norm_question in norm_message), None)
+        return self.get_question_by_id(question_id) if question_id is not None else None
+
+
+def _question_body(message_text: str) -> str:
+    """
+    The question part of a quiz message ("Daily X Challenge" / difficulty / question / reply prompt),
+    so header and footer words don't dilute the similarity. Other texts are returned unchanged.
+    """
+    parts = message_text.split("\n\n")
+    if len(parts) >= 4 and "Challenge" in parts[0]:
+        return "\n\n".join(parts[2:-1])
+    return message_text
@@ -0,0 +1,73 @@
+from typing import Dict, Any, Optional
+from db import get_connection
+
+class UsageService:
+    """Persists per-call LLM token, cost and latency accounting."""
+
+    def record_usage(self, kind: str, model: str, prompt_tokens: int, completion_tokens: int,
+                     cached_tokens: int, cost_usd: float, latency_ms: int,
+                     user_id: Optional[int] = None, question_id: Optional[int] = None):
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            INSERT INTO llm_usage (user_id, question_id, kind, model, prompt_tokens, completion_tokens,
+                                   cached_tokens, cost_usd, latency_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, question_id, kind, model, prompt_tokens, completion_tokens,
+                  cached_tokens, cost_usd, latency_ms))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_tokens_used_today(self, user_id: int) -> int:
+        """Total prompt + completion tokens spent on this user today (UTC, matching CURRENT_TIMESTAMP)."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0)
+            FROM llm_usage
+            WHERE user_id = ? AND created_at >= date('now')
+        """, (user_id,))
+        used = cursor.fetchone()[0]
+        conn.close()
+        return used
+
+    def get_question_usage(self, question_id: int) -> Dict[str, Any]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(prompt_tokens + completion_tokens), 0),
+                   COALESCE(SUM(cost_usd), 0), COALESCE(AVG(latency_ms), 0)
+            FROM llm_usage
+            WHERE question_id = ?
+        """, (question_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return {
+            "calls": row[0],
+            "tokens": row[1],
+            "cost_usd": round(row[2], 6),
+            "avg_latency_ms": round(row[3], 1)
+        }
+
+    def get_daily_totals(self) -> Dict[str, Any]:
+        """Aggregate usage across all users for today."""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),
+                   COALESCE(SUM(cached_tokens), 0), COALESCE(SUM(cost_usd), 0), COALESCE(AVG(latency_ms), 0)
+            FROM llm_usage
+            WHERE created_at >= date('now')
+        """)
+        row = cursor.fetchone()
+        conn.close()
+        return {
+            "calls": row[0],
+            "prompt_tokens": row[1],
+            "completion_tokens": row[2],
+            "cached_tokens": row[3],
+            "cost_usd": round(row[4], 6),
+            "avg_latency_ms": round(row[5], 1)
+        }
@@ -1,9 +1,40 @@
-from typing import Optional, List
+import os
+from dataclasses import replace
+from typing import Optional, List, Dict, Any
 from db import get_connection
 from models import User
+from services.cache import LRUTTLCache
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
 
 class UserService:
+    def __init__(self):
+        # telegram_id -> User. Writes below go to the DB first, then update the cached
+        # record in place (write-through), so reads never see stale data from this process.
+        # The TTL bounds staleness from writers outside the bot (e.g. manual DB edits).
+        self.cache = LRUTTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+    def _write_through(self, telegram_id: int, **changes):
+        cached = self.cache.peek(telegram_id)
+        if cached is not None:
+            self.cache.set(telegram_id, replace(cached, **changes))
+
+    def invalidate_user(self, telegram_id: int):
+        """Drops a cached user, e.g. after the row was changed outside this service."""
+        self.cache.invalidate(telegram_id)
+
+    def invalidate_all(self):
+        self.cache.clear()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
     def get_user(self, telegram_id: int) -> Optional[User]:
+        cached = self.cache.get(telegram_id)
+        if cached is not None:
+            return cached
+
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT id, telegram_id, track, preferred_time, last_sent_date, is_active, created_at FROM users WHERE telegram_id = ?", (telegram_id,))
@@ -15,10 +46,15 @@ class UserService:
             row_list = list(row)
             row_list[5] = bool(row_list[5])
             # Handle preferred_time default if null? DB default '09:00' handles it.
-            return User(*row_list)
+            user = User(*row_list)
+            self.cache.set(telegram_id, user)
+            return user
         return None
 
     def register_user(self, telegram_id: int):
+        if telegram_id in self.cache:
+            return  # Already registered; nothing to insert
+
         conn = get_connection()
         cursor = conn.cursor()
         try:
@@ -34,6 +70,7 @@ class UserService:
         try:
             cursor.execute("UPDATE users SET preferred_time = ? WHERE telegram_id = ?", (time_str, telegram_id))
             conn.commit()
+            self._write_through(telegram_id, preferred_time=time_str)
         finally:
             conn.close()
 
@@ -46,6 +83,7 @@ class UserService:
         try:
             cursor.execute("UPDATE users SET track = ?, is_active = 1 WHERE telegram_id = ?", (track, telegram_id))
             conn.commit()
+            self._write_through(telegram_id, track=track, is_active=True)
         finally:
             conn.close()
 
@@ -57,9 +95,13 @@ class UserService:
         conn = get_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute("SELECT track FROM users WHERE telegram_id = ?", (telegram_id,))
-            row = cursor.fetchone()
-            current_tracks_str = row[0] if row and row[0] else ""
+            cached = self.cache.peek(telegram_id)
+            if cached is not None:
+                current_tracks_str = cached.track or ""
+            else:
+                cursor.execute("SELECT track FROM users WHERE telegram_id = ?", (telegram_id,))
+                row = cursor.fetchone()
+                current_tracks_str = row[0] if row and row[0] else ""
             
             tracks = set(current_tracks_str.split(',')) if current_tracks_str else set()
             tracks.discard('') # Remove empty strings if any
@@ -76,6 +118,7 @@ class UserService:
             
             cursor.execute("UPDATE users SET track = ? WHERE telegram_id = ?", (new_tracks_str, telegram_id))
             conn.commit()
+            self._write_through(telegram_id, track=new_tracks_str)
             
             return new_tracks_str
         finally:
@@ -87,6 +130,7 @@ class UserService:
         try:
             cursor.execute("UPDATE users SET is_active = ? WHERE telegram_id = ?", (is_active, telegram_id))
             conn.commit()
+            self._write_through(telegram_id, is_active=bool(is_active))
         finally:
             conn.close()
 
@@ -96,6 +140,7 @@ class UserService:
         try:
             cursor.execute("UPDATE users SET last_sent_date = ? WHERE telegram_id = ?", (date_str, telegram_id))
             conn.commit()
+            self._write_through(telegram_id, last_sent_date=date_str)
         finally:
             conn.close()
             
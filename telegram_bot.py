@@ -2,31 +2,69 @@ import os
 import asyncio
 import re
 from datetime import datetime
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, TypeHandler
 
 from services.user_service import UserService
 from services.quiz_service import QuizService
 from services.progress_service import ProgressService
+from services.archive_service import ArchiveService
+from services.analytics_service import AnalyticsService
 from llm.evaluator import LLMEvaluator
+from llm.resilience import CircuitBreaker
+from persistence import SQLitePersistence
+from services.coalescing import KeyedLocks, RecentIds
+from services.cache import LRUTTLCache
+from profiler import runtime_profiler, stall_detector
+from transport import telegram_requests
+from tenancy import TenantLocal, current_tenant
 
 # Initialize Services (Globally available but initialized safely)
-user_service = UserService()
-quiz_service = QuizService()
-progress_service = ProgressService()
+# Each handle resolves to the active tenant's instance when several bots share the process (see tenancy.py)
+user_service = TenantLocal("user_service", UserService())
+quiz_service = TenantLocal("quiz_service", QuizService())
+progress_service = TenantLocal("progress_service", ProgressService())
+archive_service = TenantLocal("archive_service", ArchiveService())
+analytics_service = TenantLocal("analytics_service", AnalyticsService())
 llm_evaluator = None # Will be initialized in create_app
 
+# Comma-separated Telegram user ids allowed to use admin commands
+ADMIN_TELEGRAM_IDS = {int(x) for x in os.getenv("ADMIN_TELEGRAM_IDS", "").split(",") if x.strip()}
+
+def is_admin(telegram_id: int) -> bool:
+    return telegram_id in ADMIN_TELEGRAM_IDS
+
+def get_llm_evaluator() -> LLMEvaluator:
+    """Returns the process-wide evaluator (one OpenAI client and connection pool for all handlers)."""
+    global llm_evaluator
+    if llm_evaluator is None:
+        llm_evaluator = LLMEvaluator()
+    return llm_evaluator
+
+# Answers from the same user are handled one at a time; redelivered updates are dropped
+user_locks = KeyedLocks()
+recent_updates = RecentIds()
+# The last answer graded per (bot, user): the same text sent again within the window is not regraded
+# (a double tap, or a resend while waiting, would otherwise be graded against the next question)
+DUPLICATE_ANSWER_WINDOW = float(os.getenv("DUPLICATE_ANSWER_WINDOW", "120"))
+recent_answers = LRUTTLCache(maxsize=10000, ttl=DUPLICATE_ANSWER_WINDOW)
+
 async def post_init(application):
     """Sets the bot commands in the menu."""
     commands = [
         BotCommand("start", "Start/Restart & Settings"),
         BotCommand("track", "Change tracks"),
         BotCommand("stats", "Check progress & streak"),
+        BotCommand("history", "Your recent answers"),
+        BotCommand("leaderboard", "Top players & your rank"),
         BotCommand("users", "Check total users (Admin)"),
         BotCommand("help", "Get help"),
         BotCommand("stop", "Pause daily quizzes")
     ]
     await application.bot.set_my_commands(commands)
+    if os.getenv("STALL_THRESHOLD_MS"):
+        stall_detector.start()
 
 async def send_initial_questions(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     """Helper to send initial questions after setup or time change."""
@@ -52,13 +90,14 @@ async def send_initial_questions(user_id: int, context: ContextTypes.DEFAULT_TYP
             track = track.strip()
             if not track: continue
             
-            q = quiz_service.get_next_question_for_user(user_id, track)
+            q = quiz_service.get_next_question_for_user(db_user.id, track)
             if q:
                 msg = f"📅 **Daily {track.upper()} Challenge**\n\n" \
                       f"🔹 **Difficulty:** {q.difficulty.upper()}\n\n" \
                       f"{q.question_text}\n\n" \
                       f"👇 _Reply with your answer/code!_"
                 await context.bot.send_message(chat_id=user_id, text=msg, parse_mode='Markdown')
+                quiz_service.mark_question_sent(db_user.id, q.id)
                 sent_count += 1
         
         if sent_count > 0:
@@ -137,7 +176,13 @@ async def track_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global llm_evaluator
+    # update_id is only unique per bot; key by bot too when several bots share the process
+    if recent_updates.check_and_add((context.bot.id, update.update_id)):
+        return
+    async with user_locks.hold((context.bot.id, update.effective_user.id)):
+        await _handle_message(update, context)
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_text = update.message.text
     
@@ -176,10 +221,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
          await update.message.reply_text("No tracks selected. Use /track to select SQL or Python.")
          return
 
-    # Find pending questions for all active tracks
+    # Find pending questions for all active tracks (the ones last sent, not whatever is queued next)
     pending_questions = []
     for track in user_tracks:
-        q = quiz_service.get_next_question_for_user(user.id, track)
+        q = quiz_service.get_pending_question_for_user(user.id, track)
         if q:
             pending_questions.append(q)
     
@@ -194,8 +239,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         target_question = quiz_service.get_question_from_message_text(reply_text)
         
         if target_question:
-            # Check if this specific question is already answered
-            if quiz_service.is_question_answered_by_user(user_id, target_question.id):
+            # Check if this specific question is already answered (and not back for a re-ask)
+            if quiz_service.is_question_answered_by_user(user.id, target_question.id) \
+                    and not quiz_service.is_question_due_for_reask(user.id, target_question.id):
                 await update.message.reply_text("✅ You have already answered this question!")
                 return
             
@@ -204,9 +250,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # (though normally it should be, unless they have multiple pending).
             pending_questions = [target_question]
 
-    # Initialize LLM
-    if llm_evaluator is None:
-        llm_evaluator = LLMEvaluator()
+    llm_evaluator = get_llm_evaluator()
     
     await update.message.reply_chat_action(action="typing")
 
@@ -214,13 +258,54 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_text.lower().strip() in ['hint', 'help', 'clue', 'direction']:
         response = ""
         for q in pending_questions:
-            hint_text = await llm_evaluator.generate_hint(q.question_text, q.canonical_answer)
+            hint_text = await llm_evaluator.generate_hint(q.question_text, q.canonical_answer,
+                                                          user_id=user.id, question_id=q.id)
             response += f"🔍 **Hint for {q.track.upper()}:**\n{hint_text}\n\n"
         
         await update.message.reply_text(response, parse_mode='Markdown')
         return
 
-    # Evaluate against all pending questions (or the filtered one) to find the best match
+    # Runs under the user's lock, so a duplicate sees the first copy's result here
+    answer_key = (context.bot.id, user_id)
+    if recent_answers.get(answer_key) == user_text.strip():
+        await update.message.reply_text("👆 You just sent this exact answer - it is already being handled.")
+        return
+
+    best_question, best_result = await evaluate_best_match(pending_questions, user, user_text)
+
+    if best_result and best_result.get("deferred"):
+        # OpenAI is degraded: queue the evaluation and answer once the circuit closes
+        lock_key = (context.bot.id, user_id)
+
+        async def deferred_evaluation(last_attempt):
+            async with user_locks.hold(lock_key):
+                question, result = await evaluate_best_match(pending_questions, user, user_text)
+                # The replay may be the half-open probe: keep the job until a call really succeeded
+                failed = (result and (result.get("deferred") or result.get("retryable"))) \
+                    or llm_evaluator.breaker.state != CircuitBreaker.CLOSED
+                if failed and not last_attempt:
+                    return False
+                if result and result.get("deferred"):
+                    await update.message.reply_text(
+                        "⚠️ The AI grader is still unavailable, so your answer could not be graded. "
+                        "Please send it again later.")
+                    return True
+                await reply_with_evaluation(update.message, user, user_text, question, result)
+                return True
+
+        if llm_evaluator.deferred.submit(deferred_evaluation):
+            recent_answers.set(answer_key, user_text.strip())
+            await update.message.reply_text(best_result["short_feedback"])
+        else:
+            await update.message.reply_text("⚠️ The AI grader is overloaded. Please try again in a few minutes.")
+        return
+
+    await reply_with_evaluation(update.message, user, user_text, best_question, best_result)
+    if best_result and not best_result.get("fallback"):
+        recent_answers.set(answer_key, user_text.strip())
+
+async def evaluate_best_match(pending_questions, user, user_text):
+    """Evaluates against all pending questions (or the filtered one) and returns the best match."""
     best_result = None
     best_confidence = -1.0
     best_question = None
@@ -231,8 +316,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         evaluation = await llm_evaluator.evaluate_answer(
             question_text=question.question_text,
             canonical_answer=question.canonical_answer,
-            user_answer=user_text
+            user_answer=user_text,
+            user_id=user.id,
+            question_id=question.id
         )
+        if evaluation.get("deferred"):
+            # Breaker is open / load shed: no point evaluating the remaining questions now
+            return question, evaluation
         
         conf = evaluation.get("confidence", 0.0)
         # If is_correct is True, confidence should be high.
@@ -241,29 +331,37 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             best_confidence = conf
             best_result = evaluation
             best_question = question
-    
+
+    return best_question, best_result
+
+async def reply_with_evaluation(message, user, user_text, best_question, best_result):
     # Use the best match
     if best_question and best_result:
         is_correct = best_result.get("is_correct", False)
         feedback = best_result.get("short_feedback", "")
         # hint = best_result.get("hint", "") # We don't use the automatic hint anymore
-        
-        if is_correct:
+
+        if best_result.get("fallback"):
+            # Not graded by the model (budget spent / LLM error): record nothing, the question stays pending
+            await message.reply_text(f"⏳ {feedback}")
+        elif is_correct:
             # Record success
-            quiz_service.record_answer(user.id, best_question.id, user_text, True, best_confidence)
+            quiz_service.record_answer(user.id, best_question.id, user_text, True, best_result.get("confidence", 0.0))
             
             response = f"✅ **Correct!** ({best_question.track.upper()})\n\n{feedback}\n\n" \
                        f"💡 **Explanation:** {best_question.explanation}\n\n" \
                        f"See you tomorrow!"
-            await update.message.reply_text(response, parse_mode='Markdown')
+            await message.reply_text(response, parse_mode='Markdown')
         else:
-            # Incorrect - Ask if they want a hint
+            # Incorrect - the question stays pending; remember the miss for re-asking and difficulty
+            quiz_service.record_miss(user.id, best_question.id)
+            # Ask if they want a hint
             response = f"❌ **Incorrect.** ({best_question.track.upper()})\n\n{feedback}\n\n" \
                        f"👉 _Need a nudge? Reply with **'hint'** for a clue!_"
             
-            await update.message.reply_text(response, parse_mode='Markdown')
+            await message.reply_text(response, parse_mode='Markdown')
     else:
-        await update.message.reply_text("⚠️ Could not evaluate your answer. Please try again.")
+        await message.reply_text("⚠️ Could not evaluate your answer. Please try again.")
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -284,9 +382,170 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(text, parse_mode='Markdown')
 
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = user_service.get_user(update.effective_user.id)
+    if not user:
+        await update.message.reply_text("Please use /start to register first.")
+        return
+
+    history = archive_service.get_history(user.id, limit=5)
+    if not history:
+        await update.message.reply_text("📭 No answers yet. Reply to a question to get started!")
+        return
+
+    lines = ["🗂️ Your recent answers\n"]
+    for entry in history:
+        mark = "✅" if entry.answered_correctly else "❌"
+        answer = (entry.user_answer or "").strip().replace("\n", " ")
+        if len(answer) > 80:
+            answer = answer[:77] + "..."
+        lines.append(f"{mark} {entry.answered_at[:10]} · Q{entry.question_id}: {answer}")
+    await update.message.reply_text("\n".join(lines))
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = user_service.get_user(update.effective_user.id)
+    board = quiz_service.leaderboard
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+    lines = ["🏆 Leaderboard (correct answers)\n"]
+    for rank, user_id, score in board.top(10):
+        you = " ← you" if user and user_id == user.id else ""
+        lines.append(f"{medals.get(rank, f'#{rank}')} Player {user_id}: {score}{you}")
+    if len(lines) == 1:
+        lines.append("No correct answers yet. Be the first!")
+
+    if user:
+        rank = board.rank(user.id)
+        if rank:
+            lines.append(f"\n📍 Your rank: #{rank} of {len(board)} with {board.score(user.id)} correct")
+        else:
+            lines.append("\n📍 Answer a question correctly to join the leaderboard!")
+    await update.message.reply_text("\n".join(lines))
+
 async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     count = user_service.get_total_users_count()
-    await update.message.reply_text(f"👥 **Total Registered Users:** {count}")
+    text = f"👥 **Total Registered Users:** {count}"
+    cache = user_service.get_cache_stats()
+    text += f"\n🗂️ **User cache:** {cache['size']} cached, hit rate {cache['hit_rate']:.0%}"
+    if llm_evaluator is not None:
+        m = llm_evaluator.metrics()
+        text += f"\n🤖 **LLM:** circuit {m['breaker']['state']} " \
+                f"(opened {m['breaker']['transitions']['open']}x), " \
+                f"limit {m['limiter']['limit']}, deferred {m['deferred']}"
+    tenant = current_tenant()
+    if tenant is not None:
+        t = tenant.snapshot()
+        text += f"\n🏷️ **Bot {t['tenant']}:** {t['updates']} updates, {t['errors']} errors, " \
+                f"{t['quizzes_sent']} quizzes sent ({t['quiz_send_failures']} failed)"
+    await update.message.reply_text(text)
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Admins only.")
+        return
+
+    if context.args and context.args[0] == "refresh":
+        await update.message.reply_text("⏳ Recomputing analytics...")
+        result = await asyncio.to_thread(analytics_service.run_nightly)
+        await update.message.reply_text(
+            f"✅ {result['rows']} answers, {result['users']} users in "
+            f"{result['load_s'] + result['compute_s'] + result['save_s']:.2f}s"
+        )
+
+    overview = analytics_service.get_overview()
+    if not overview["computed_at"]:
+        await update.message.reply_text("No analytics yet. Use /analytics refresh to compute them now.")
+        return
+
+    lines = [
+        f"📈 Analytics (computed {overview['computed_at']})\n",
+        f"👥 Users with answers: {overview['users']}",
+        f"📝 Answers: {overview['total_answered']} · 🎯 Accuracy: {overview['accuracy']}%",
+        f"🔥 On a streak: {overview['users_on_streak']} · avg {overview['avg_current_streak']} · best {overview['longest_streak']} days",
+        "\n🧩 Hardest questions:"
+    ]
+    for q in analytics_service.get_hardest_questions():
+        lines.append(f"  Q{q['question_id']} ({q['track']}/{q['difficulty']}): "
+                     f"{q['correct_rate']:.0%} correct, conf {q['avg_confidence']:.2f}, {q['attempts']} attempts")
+
+    lines.append("\n📅 Weekly retention (cohort: week 0, 1, 2, ...):")
+    cohorts = {}
+    for row in analytics_service.get_retention():
+        cohorts.setdefault(row["cohort_week"], []).append(f"{row['retention']:.0%}")
+    for week, values in cohorts.items():
+        lines.append(f"  {week}: " + " · ".join(values))
+
+    await update.message.reply_text("\n".join(lines))
+
+PROFILE_USAGE = (
+    "/profile cpu|sample <seconds> - profile for a time window\n"
+    "/profile cpu|sample updates <n> - profile the next n updates\n"
+    "/profile stop - finish now and send the dump\n"
+    "/profile stalls on [ms]|off - log event-loop stalls"
+)
+
+async def count_profiled_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    runtime_profiler.count_update()
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Admins only.")
+        return
+
+    args = context.args or []
+    if not args:
+        status = f"running ({runtime_profiler.mode})" if runtime_profiler.active else "idle"
+        stalls = "on" if stall_detector.running else "off"
+        await update.message.reply_text(
+            f"🔬 Profiler: {status}\n"
+            f"⏱️ Stall detection: {stalls}, {stall_detector.stall_count} stalls, "
+            f"longest {stall_detector.longest_stall * 1000:.0f} ms\n\n{PROFILE_USAGE}"
+        )
+        return
+
+    if args[0] == "stop":
+        path = runtime_profiler.stop()
+        if not path:
+            await update.message.reply_text("No profile is running.")
+        return  # The on_finish callback sends the dump
+
+    if args[0] == "stalls":
+        if len(args) > 1 and args[1] == "off":
+            stall_detector.stop()
+            await update.message.reply_text("⏱️ Stall detection off.")
+        else:
+            if len(args) > 2 and args[2].isdigit():
+                stall_detector.threshold = int(args[2]) / 1000
+            stall_detector.start()
+            await update.message.reply_text(
+                f"⏱️ Stall detection on, threshold {stall_detector.threshold * 1000:.0f} ms. Stacks go to the log."
+            )
+        return
+
+    mode = args[0]
+    seconds = updates = None
+    if len(args) > 2 and args[1] == "updates" and args[2].isdigit():
+        updates = int(args[2])
+    elif len(args) > 1 and args[1].isdigit():
+        seconds = int(args[1])
+    if mode not in ("cpu", "sample") or not (seconds or updates):
+        await update.message.reply_text(PROFILE_USAGE)
+        return
+
+    chat_id = update.effective_chat.id
+    bot = context.bot
+
+    async def send_dump(path):
+        with open(path, "rb") as f:
+            await bot.send_document(chat_id, f, caption=f"🔬 {os.path.basename(path)}")
+
+    try:
+        runtime_profiler.start(mode, seconds=seconds, updates=updates, on_finish=send_dump)
+    except RuntimeError as e:
+        await update.message.reply_text(f"⚠️ {e}")
+        return
+    window = f"{seconds}s" if seconds else f"the next {updates} updates"
+    await update.message.reply_text(f"🔬 {mode} profiling for {window}.")
 
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -298,25 +557,44 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Register and choose track\n"
         "/track - Change your learning track\n"
         "/stats - View your progress\n"
+        "/history - Your recent answers\n"
+        "/leaderboard - Top players & your rank\n"
         "/stop - Pause daily messages"
     )
     await update.message.reply_text(text)
 
-def create_app():
-    global llm_evaluator
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
+def create_app(token: Optional[str] = None):
+    token = token or os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables.")
     
     # Initialize LLM evaluator here after env vars are loaded
-    llm_evaluator = LLMEvaluator()
+    get_llm_evaluator()
         
-    app = ApplicationBuilder().token(token).post_init(post_init).build()
+    # Separate, sized connection pools for sending and for long polling
+    request, get_updates_request = telegram_requests()
+    # Persist user_data (e.g. the onboarding 'awaiting_time' flag) across restarts
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .build()
+    )
     
+    # Runs before the other handler groups so update-bounded profiles see every update
+    app.add_handler(TypeHandler(Update, count_profiled_update), group=-1)
+
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("track", start)) # Reuse start for track selection
     app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("history", history_command))
+    app.add_handler(CommandHandler("leaderboard", leaderboard_command))
     app.add_handler(CommandHandler("users", users_command))
+    app.add_handler(CommandHandler("analytics", analytics_command))
+    app.add_handler(CommandHandler("profile", profile_command))
     app.add_handler(CommandHandler("stop", stop_command))
     app.add_handler(CommandHandler("help", help_command))
     
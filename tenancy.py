@@ -0,0 +1,118 @@
+"""
+Several branded quiz bots in one process.
+
+TELEGRAM_BOT_TOKENS="sqlbot=123:AAA,pybot=456:BBB" runs one Application per bot on a shared
+event loop (see main.run_tenants). Tenants share the LLMEvaluator (one OpenAI connection
+pool, limiter and circuit breaker), the formatted question catalog and a single scheduler.
+User data is tenant-scoped: every tenant has its own SQLite database (TENANT_DB_DIR/<name>.db)
+and its own service instances with their caches.
+
+The active tenant travels in a ContextVar. Tenant.activate() sets it together with the
+database path, and asyncio tasks and asyncio.to_thread calls started inside inherit both, so
+handlers and services stay unaware of tenancy. Module-level service handles in telegram_bot
+are TenantLocal proxies that resolve to the active tenant's instance.
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from db import DB_PATH, use_database
+from services.analytics_service import AnalyticsService
+from services.archive_service import ArchiveService
+from services.progress_service import ProgressService
+from services.quiz_service import QuestionCatalog, QuizService
+from services.user_service import UserService
+
+logger = logging.getLogger(__name__)
+
+TENANT_DB_DIR = os.getenv("TENANT_DB_DIR", os.path.join(os.path.dirname(DB_PATH), "tenants"))
+
+_current: ContextVar[Optional["Tenant"]] = ContextVar("tenant", default=None)
+
+
+def current_tenant() -> Optional["Tenant"]:
+    return _current.get()
+
+
+class Tenant:
+    """One bot: its token, database, services, Application and counters."""
+
+    def __init__(self, name: str, token: str, catalog: QuestionCatalog, db_path: Optional[str] = None):
+        self.name = name
+        self.token = token
+        self.db_path = db_path or os.path.join(TENANT_DB_DIR, f"{name}.db")
+        self.user_service = UserService()
+        self.quiz_service = QuizService(catalog=catalog)
+        self.progress_service = ProgressService()
+        self.archive_service = ArchiveService()
+        self.analytics_service = AnalyticsService()
+        self.application = None
+        self.metrics = Counter()
+        self.started_at = time.time()
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            with use_database(self.db_path):
+                yield self
+        finally:
+            _current.reset(token)
+
+    async def count_update(self, update, context):
+        self.metrics["updates"] += 1
+
+    async def record_error(self, update, context):
+        self.metrics["errors"] += 1
+        logger.error(f"[{self.name}] Error handling update: {context.error}", exc_info=context.error)
+
+    def snapshot(self) -> Dict[str, Any]:
+        cache = self.user_service.get_cache_stats()
+        return {
+            "tenant": self.name,
+            "uptime_s": int(time.time() - self.started_at),
+            "updates": self.metrics["updates"],
+            "errors": self.metrics["errors"],
+            "quizzes_sent": self.metrics["quizzes_sent"],
+            "quiz_send_failures": self.metrics["quiz_send_failures"],
+            "cached_users": cache["size"],
+            "user_cache_hit_rate": cache["hit_rate"],
+        }
+
+
+class TenantLocal:
+    """Module-level handle for a service: the active tenant's instance, else the process default."""
+
+    def __init__(self, name: str, default):
+        self._name = name
+        self._default = default
+
+    def __getattr__(self, attr):
+        tenant = _current.get()
+        target = getattr(tenant, self._name) if tenant is not None else self._default
+        return getattr(target, attr)
+
+
+def load_tenants(spec: Optional[str] = None) -> List[Tenant]:
+    """Parses TELEGRAM_BOT_TOKENS ("name=token,name=token") into tenants sharing one catalog."""
+    spec = spec if spec is not None else os.getenv("TELEGRAM_BOT_TOKENS", "")
+    catalog = QuestionCatalog()
+    tenants = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, token = entry.partition("=")
+        name = name.strip()
+        if not sep or not token.strip():
+            raise ValueError(f"TELEGRAM_BOT_TOKENS entry '{name}' must look like name=token.")
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", name):
+            raise ValueError(f"Invalid tenant name '{name}' (letters, digits, '_' and '-' only).")
+        if any(t.name == name for t in tenants):
+            raise ValueError(f"Duplicate tenant name '{name}' in TELEGRAM_BOT_TOKENS.")
+        tenants.append(Tenant(name, token.strip(), catalog))
+    if not tenants:
+        raise ValueError("TELEGRAM_BOT_TOKENS is empty.")
+    return tenants
@@ -0,0 +1,77 @@
+"""
+HTTP transport settings shared by the Telegram and OpenAI clients.
+
+Both libraries sit on httpx; this module makes their connection pools, timeouts and HTTP
+version explicit and configurable in one place.
+
+- Telegram sending (send_message, replies, documents): a pool of TELEGRAM_POOL_SIZE connections
+  (default 256, the size ApplicationBuilder uses), with TELEGRAM_POOL_TIMEOUT / TELEGRAM_TIMEOUT
+  instead of python-telegram-bot's 1s pool wait and 5s read/write timeouts.
+- Telegram polling (getUpdates): its own 1-connection pool, as ApplicationBuilder does, so a long
+  poll never holds a connection that sends are waiting for.
+- OpenAI: an httpx.AsyncClient with LLM_POOL_SIZE connections, of which LLM_KEEPALIVE stay
+  open between bursts for HTTP_KEEPALIVE_EXPIRY seconds.
+
+HTTP/2 is used when the optional `h2` package is installed (HTTP2=auto), forced with HTTP2=1 or
+disabled with HTTP2=0. With HTTP/2 many requests share one multiplexed connection per host.
+"""
+import importlib.util
+import os
+from typing import Tuple
+
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "256"))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "10"))
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+LLM_KEEPALIVE = int(os.getenv("LLM_KEEPALIVE", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+
+def http2_enabled() -> bool:
+    setting = os.getenv("HTTP2", "auto").lower()
+    if setting in ("0", "false", "no"):
+        return False
+    if setting in ("1", "true", "yes"):
+        return True
+    return importlib.util.find_spec("h2") is not None
+
+
+def telegram_requests() -> Tuple["HTTPXRequest", "HTTPXRequest"]:
+    """(request, get_updates_request) for ApplicationBuilder.request()/.get_updates_request()."""
+    from telegram.request import HTTPXRequest
+
+    http_version = "2" if http2_enabled() else "1.1"
+    request = HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_TIMEOUT,
+        write_timeout=TELEGRAM_TIMEOUT,
+        http_version=http_version,
+    )
+    # getUpdates adds its long-poll timeout to read_timeout itself
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_TIMEOUT,
+        http_version=http_version,
+    )
+    return request, get_updates_request
+
+
+def llm_http_client():
+    """httpx.AsyncClient for openai.AsyncClient(http_client=...)."""
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_SIZE,
+            max_keepalive_connections=LLM_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )